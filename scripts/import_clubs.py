@@ -0,0 +1,61 @@
+"""
+Create or update clubs from a JSON or YAML file with a list of clubs (matched by slug).
+
+Clubs are sent to the `POST /clubs/bulk` endpoint of the running API, so its caches are updated right away.
+The token of an admin is taken from --token or the CLUBS_API_TOKEN environment variable.
+
+Usage: uv run ./scripts/import_clubs.py clubs.yaml --api-url http://127.0.0.1:8000
+"""
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+import httpx
+import yaml
+
+BULK_MAX_CLUBS = 1000
+"Maximum number of clubs in one request to `POST /clubs/bulk`"
+
+
+def load_clubs(path: Path) -> list:
+    with open(path) as f:
+        if path.suffix in (".yaml", ".yml"):
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def main(path: Path, api_url: str, token: str) -> int:
+    clubs = load_clubs(path)
+    results = []
+    with httpx.Client(base_url=api_url, headers={"Authorization": f"Bearer {token}"}, timeout=60) as client:
+        for i in range(0, len(clubs), BULK_MAX_CLUBS):
+            response = client.post("/clubs/bulk", json=clubs[i : i + BULK_MAX_CLUBS])
+            if response.is_error:
+                print(f"Request failed with {response.status_code}: {response.text}", file=sys.stderr)
+                return 1
+            results.extend(response.json())
+
+    for number, result in enumerate(results, 1):
+        line = f"{result['status']:>8}  {result['slug'] or f'#{number}'}"
+        if result.get("id"):
+            line += f"  ({result['id']})"
+        if result.get("reason"):
+            line += f"  {result['reason']}"
+        print(line)
+    failed = sum(result["status"] == "failed" for result in results)
+    print(f"Total: {len(results)}, failed: {failed}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", type=Path, help="JSON or YAML file with a list of clubs")
+    parser.add_argument("--api-url", default="http://127.0.0.1:8000", help="URL of the API (with the root path)")
+    parser.add_argument("--token", default=os.environ.get("CLUBS_API_TOKEN"), help="Token of an admin")
+    args = parser.parse_args()
+    if not args.token:
+        parser.error("the token is required (--token or CLUBS_API_TOKEN)")
+    sys.exit(main(args.path, args.api_url, args.token))
@@ -0,0 +1,59 @@
+"""
+Helpers for conditional requests (ETag / If-None-Match and Last-Modified / If-Modified-Since).
+"""
+
+__all__ = ["make_etag", "is_not_modified", "validator_headers", "not_modified_response"]
+
+import datetime
+import hashlib
+from email.utils import format_datetime, parsedate_to_datetime
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+
+def make_etag(content: bytes) -> str:
+    """
+    Weak content-hash ETag. It is weak because the same value is sent for every Content-Encoding of the body.
+    """
+    return f'W/"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+
+
+def is_not_modified(request_headers: Headers, etag: str | None, last_modified: datetime.datetime | None = None) -> bool:
+    """
+    Check whether the client's cached copy is still valid, so the server may answer with 304 Not Modified.
+    If-None-Match takes precedence over If-Modified-Since (RFC 9110, section 13.2.2).
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag is None:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison
+        opaque_tag = etag.removeprefix("W/")
+        return any(tag.strip().removeprefix("W/") == opaque_tag for tag in if_none_match.split(","))
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=datetime.UTC)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def validator_headers(etag: str | None, last_modified: datetime.datetime | None = None) -> dict[str, str]:
+    headers = {}
+    if etag is not None:
+        headers["ETag"] = etag
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.astimezone(datetime.UTC), usegmt=True)
+    return headers
+
+
+def not_modified_response(headers: dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
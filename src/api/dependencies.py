@@ -25,7 +25,7 @@ async def get_current_user_auth(
     token = bearer and bearer.credentials
     if not token:
         raise IncorrectCredentialsException(no_credentials=True)
-    token_data = inh_accounts.decode_token(token)
+    token_data = await inh_accounts.decode_token(token)
     if token_data is None:
         raise IncorrectCredentialsException(no_credentials=False)
     return token_data
@@ -35,8 +35,8 @@ USER_AUTH = Annotated[UserTokenData, Depends(get_current_user_auth)]
 
 
 async def require_admin(current_user: USER_AUTH):
-    innohassle_user = await users_crud.read_by_innohassle_id(current_user.innohassle_id)
-    if not innohassle_user or innohassle_user.role != UserRole.ADMIN:
+    role = await users_crud.read_role(current_user.innohassle_id)
+    if role != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="You are not an admin")
     return current_user
 
@@ -45,7 +45,29 @@ async def lifespan(_app: FastAPI):
     from src.modules.inh_accounts_sdk import inh_accounts  # noqa: E402
 
     await inh_accounts.update_key_set()
+    key_set_refresher = asyncio.create_task(inh_accounts.run_key_set_refresher())
+
+    import src.modules.clubs.crud as clubs_crud  # noqa: E402
+
+    await clubs_crud.cache.load()
+    clubs_revalidation = asyncio.create_task(
+        clubs_crud.cache.run_revalidation(settings.clubs_cache.revalidate_interval)
+    )
+
+    import src.modules.leaders.crud as leaders_crud  # noqa: E402
+
+    snapshots_refresher = asyncio.create_task(leaders_crud.run_snapshots_refresher())
+
+    from src.modules.clubs.logo import logo_processor  # noqa: E402
+    from src.storages.minio import minio_executor  # noqa: E402
+
     yield
 
     # -- Application shutdown --
+    snapshots_refresher.cancel()
+    clubs_revalidation.cancel()
+    key_set_refresher.cancel()
+    logo_processor.shutdown()
+    minio_executor.shutdown(wait=False)
+    await inh_accounts.aclose()
     motor_client.close()
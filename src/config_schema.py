@@ -21,6 +21,92 @@ class Accounts(SettingBaseModel):
     "URL of the Accounts API"
     api_jwt_token: SecretStr
     "JWT token for accessing the Accounts API as a service"
+    http2: bool = True
+    "Use HTTP/2 for requests to the Accounts API"
+    max_connections: int = 20
+    "Maximum number of connections to the Accounts API"
+    max_keepalive_connections: int = 10
+    "Maximum number of idle connections kept open"
+    keepalive_expiry: float = 60.0
+    "Time in seconds after which an idle connection is closed"
+    timeout: float = 5.0
+    "Timeout in seconds for requests to the Accounts API"
+    connect_timeout: float = 2.0
+    "Timeout in seconds for establishing a connection to the Accounts API"
+    lookup_timeout: float = 2.0
+    "Timeout in seconds for a single user lookup"
+    bulk_timeout: float = 5.0
+    "Timeout in seconds for a bulk user lookup"
+    max_retries: int = 2
+    "Maximum number of retries of a failed request (connection errors, timeouts and 5xx responses)"
+    retry_backoff: float = 0.1
+    "Base delay in seconds between retries; the delay is random up to `retry_backoff * 2^attempt`"
+    retry_budget_ratio: float = 0.1
+    "Retries allowed per request on average, so retries cannot multiply the load on an overloaded Accounts API"
+    retry_budget_max: float = 10.0
+    "Maximum number of retries that can be accumulated in the retry budget"
+    breaker_failure_threshold: int = 5
+    "Number of consecutive failed requests after which requests to the Accounts API are stopped"
+    breaker_reset_timeout: float = 30.0
+    "Time in seconds after which a single trial request is sent to check if the Accounts API has recovered"
+    jwks_refresh_interval: float = 3600.0
+    "Interval in seconds between background refreshes of the JWKS (public keys for verifying user tokens)"
+    jwks_min_refresh_interval: float = 30.0
+    "Minimum time in seconds between JWKS refreshes caused by tokens signed with an unknown key"
+    token_cache_size: int = 10_000
+    "Maximum number of verified user tokens kept in memory to skip signature verification"
+    token_cache_negative_ttl: float = 5.0
+    "Time in seconds to remember that a token is invalid"
+    concurrent_lookups: bool = True
+    "Send lookups by several identifiers concurrently instead of one after another"
+    batch_window: float = 0.005
+    "Time in seconds to collect single user lookups into one bulk request"
+    batch_max_size: int = 100
+    "Maximum number of users in one bulk request; a full batch is sent without waiting for the window"
+
+
+class ClubsCache(SettingBaseModel):
+    """In-process cache of the clubs collection"""
+
+    revalidate_interval: float = 60.0
+    "Interval in seconds between checks for changes made to the clubs collection by other processes"
+
+
+class LeadersCache(SettingBaseModel):
+    """Cache of club leaders profiles from InNoHassle Accounts"""
+
+    ttl: float = 600.0
+    "Time in seconds after which a cached profile is refreshed in the background"
+    stale_ttl: float = 7 * 24 * 3600.0
+    "Max age in seconds of a profile that can be served while refreshing or when Accounts is unavailable"
+    negative_ttl: float = 60.0
+    "Time in seconds to remember that a user is not found"
+    bulk_chunk_size: int = 100
+    "Maximum number of users requested from InNoHassle Accounts in one bulk request"
+    bulk_concurrency: int = 4
+    "Maximum number of concurrent bulk requests to InNoHassle Accounts"
+    snapshot_ttl: float = 24 * 3600.0
+    "Time in seconds after which a leader snapshot embedded in a club is refreshed"
+    snapshot_refresh_interval: float = 600.0
+    "Interval in seconds between background checks for outdated leader snapshots"
+
+
+class ExecutorType(StrEnum):
+    PROCESS = "process"
+    THREAD = "thread"
+
+
+class LogoProcessing(SettingBaseModel):
+    """Processing of uploaded club logos"""
+
+    executor: ExecutorType = ExecutorType.PROCESS
+    "Run image processing in worker processes or threads"
+    max_workers: int = 2
+    "Number of logos processed concurrently"
+    max_queue: int = 8
+    "Number of logos that may wait for a free worker; further uploads are rejected with 503"
+    retry_after: int = 5
+    "Value of the Retry-After header (seconds) when the upload is rejected"
 
 
 class MinioSettings(SettingBaseModel):
@@ -38,6 +124,12 @@ class MinioSettings(SettingBaseModel):
     "Secret key (password) for the user account."
 
     club_logos_prefix: str = "logos/"
+    max_connections: int = 10
+    "Size of the connection pool and of the thread pool for blocking requests"
+    connect_timeout: float = 5.0
+    "Timeout in seconds for establishing a connection"
+    read_timeout: float = 30.0
+    "Timeout in seconds for reading a response"
 
 
 class Settings(SettingBaseModel):
@@ -59,10 +151,18 @@ class Settings(SettingBaseModel):
     "Allowed origins for CORS: from which domains requests to the API are allowed. Specify as a regex: `https://.*.innohassle.ru`"
     accounts: Accounts
     "InNoHassle Accounts integration settings"
+    clubs_cache: ClubsCache = ClubsCache()
+    "In-process cache of the clubs collection"
+    leaders_cache: LeadersCache = LeadersCache()
+    "Cache of club leaders profiles"
     minio: MinioSettings
     "Configuration for S3 object storage"
+    logo_processing: LogoProcessing = LogoProcessing()
+    "Processing of uploaded club logos"
     superadmin_emails: list[str]
     "Innomails of superadmins who can set admin roles"
+    role_cache_size: int = 1000
+    "Maximum number of user roles kept in memory"
 
     @classmethod
     def from_yaml(cls, path: Path) -> "Settings":
@@ -1,6 +1,23 @@
-from beanie import PydanticObjectId
+import asyncio
+import datetime
+import gzip
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+from enum import StrEnum
+from typing import get_args
 
-from src.storages.mongo.club import Club, ClubSchema
+import brotli
+from beanie import PydanticObjectId, UpdateResponse
+from pydantic import AliasChoices, Field, TypeAdapter, ValidationError, create_model, model_validator
+from pymongo import UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from src.api.conditional import make_etag
+from src.logging_ import logger
+from src.modules.clubs.search import SearchIndex
+from src.pydantic_base import BaseSchema
+from src.storages.mongo.__base__ import MongoDbId
+from src.storages.mongo.club import Club, ClubSchema, ClubType, LeaderSnapshot
 
 
 class CreateClub(ClubSchema):
@@ -11,33 +28,562 @@ class UpdateClub(ClubSchema):
     new_leader_email: str | None = None
 
 
-async def create(data: CreateClub) -> Club:
-    return await Club.model_validate(data, from_attributes=True).create()
+class _PatchClubBase(BaseSchema):
+    new_leader_email: str | None = None
+    "Email of the new club leader, will be resolved to `leader_innohassle_id`"
+
+    @model_validator(mode="after")
+    def check_required_fields_are_not_null(self):
+        for field in _NOT_NULLABLE_FIELDS:
+            if field in self.model_fields_set and getattr(self, field) is None:
+                raise ValueError(f"`{field}` cannot be null")
+        return self
+
+    def changed_fields(self) -> dict:
+        return self.model_dump(exclude_unset=True, exclude={"new_leader_email"})
+
+
+_NOT_NULLABLE_FIELDS = {
+    name for name, field in ClubSchema.model_fields.items() if type(None) not in get_args(field.annotation)
+}
+"Fields of ClubSchema that cannot be set to null"
+
+PatchClub = create_model(
+    "PatchClub",
+    __base__=_PatchClubBase,
+    __doc__="Partial club update: only provided fields are changed",
+    **{
+        name: (field.annotation | None, Field(None, description=field.description))
+        for name, field in ClubSchema.model_fields.items()
+    },
+)
+
+
+class ClubsBatchRequest(BaseSchema):
+    ids: list[MongoDbId] = Field(default_factory=list, max_length=1000)
+    "IDs of clubs to get"
+    slugs: list[str] = Field(default_factory=list, max_length=1000)
+    "Slugs of clubs to get"
+
+
+class ClubsBatchResponse(BaseSchema):
+    by_id: dict[str, Club | None]
+    "Requested clubs by id (None if not found)"
+    by_slug: dict[str, Club | None]
+    "Requested clubs by slug (None if not found)"
+
+
+class BulkUpsertStatus(StrEnum):
+    CREATED = "created"
+    UPDATED = "updated"
+    FAILED = "failed"
+
+
+class BulkUpsertResult(BaseSchema):
+    slug: str | None
+    "Slug of the club (null if the item has no valid slug)"
+    status: BulkUpsertStatus
+    "What happened with the club"
+    id: MongoDbId | None = None
+    "ID of the created or updated club"
+    reason: str | None = None
+    "Reason of the failure"
+
+
+class ClubCard(BaseSchema):
+    """Short club info for displaying in cards"""
+
+    id: MongoDbId = Field(validation_alias=AliasChoices("_id", "id"), serialization_alias="id")
+    "MongoDB document ObjectID"
+    slug: str
+    "Alias for using in URL and identification"
+    title: str
+    "Title of the club"
+    short_description: str
+    "Short description for displaying in cards"
+    type: ClubType
+    "Type of the club"
+    logo_file_id: str | None = None
+    "File ID of the logo picture"
+
+    class Settings:
+        projection = {"_id": 1, "slug": 1, "title": 1, "short_description": 1, "type": 1, "logo_file_id": 1}
+
+
+class ClubsCacheStats(BaseSchema):
+    loaded: bool
+    "True if the clubs collection is loaded into the cache"
+    size: int
+    "Number of cached clubs"
+    hits: int
+    "Number of lookups by id or slug that found a club"
+    misses: int
+    "Number of lookups by id or slug that found no club"
+    loads: int
+    "Number of times the collection was loaded from the database"
+    revalidations: int
+    "Number of times the cache was reloaded because the database was changed by another process"
+    version: int
+    "Counter that is incremented on every club mutation"
+
+
+@dataclass(frozen=True, slots=True)
+class ClubsListSnapshot:
+    """Serialized list of all clubs, ready to be sent as a response body."""
+
+    json: bytes
+    gzip: bytes
+    br: bytes
+    etag: str
+
+    @classmethod
+    def build(cls, clubs: list[Club]) -> "ClubsListSnapshot":
+        json_ = _clubs_list_adapter.dump_json(clubs, by_alias=True)
+        return cls(json=json_, gzip=gzip.compress(json_, mtime=0), br=brotli.compress(json_), etag=make_etag(json_))
+
+
+_clubs_list_adapter = TypeAdapter(list[Club])
+
+
+class ClubsCache:
+    """
+    In-process cache of the whole clubs collection, indexed by id, slug and leader id.
+    The catalogue is small, so it is loaded at once (at startup or on the first read)
+    and kept in sync by the write functions of this module.
+    """
+
+    by_id: dict[PydanticObjectId, Club]
+    by_slug: dict[str, Club]
+    by_leader: dict[str, list[Club]]
+    search_index: SearchIndex
+    loaded: bool
+    version: int
+    last_modified: datetime.datetime
+    "Time of the last club mutation (or of the cache loading)"
+    hits: int
+    misses: int
+    loads: int
+    revalidations: int
+
+    def __init__(self):
+        self.by_id = {}
+        self.by_slug = {}
+        self.by_leader = {}
+        self.search_index = SearchIndex()
+        self.loaded = False
+        self.version = 0
+        self.last_modified = datetime.datetime.now(datetime.UTC)
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.revalidations = 0
+        self._lock = asyncio.Lock()
+        self._list_snapshot: ClubsListSnapshot | None = None
+        self._etags: dict[PydanticObjectId, str] = {}
+
+    async def ensure_loaded(self) -> None:
+        if not self.loaded:
+            await self.load()
+
+    def get_by_id(self, id: PydanticObjectId) -> Club | None:
+        return self._count(self.by_id.get(id))
+
+    def get_by_slug(self, slug: str) -> Club | None:
+        return self._count(self.by_slug.get(slug))
+
+    async def load(self) -> None:
+        async with self._lock:
+            if self.loaded:
+                return
+            while True:
+                version = self.version
+                clubs = await Club.all().to_list()
+                # Retry if the collection was changed while we were reading it
+                if version == self.version:
+                    break
+            self._replace(clubs)
+            self._list_snapshot = None
+            self.last_modified = datetime.datetime.now(datetime.UTC)
+            self.loaded = True
+            self.loads += 1
+
+    async def revalidate(self) -> bool:
+        """
+        Reload the collection and replace the cache if it differs, to pick up changes made by other processes
+        (scripts, manual fixes, other instances). Returns True if the cache was replaced.
+        """
+        if not self.loaded:
+            return False
+        async with self._lock:
+            version = self.version
+            clubs = await Club.all().to_list()
+            # Changed by this process meanwhile, the next revalidation will compare again
+            if version != self.version or not self.loaded:
+                return False
+            fresh = {club.id: club.model_dump_json() for club in clubs}
+            if fresh == {id: club.model_dump_json() for id, club in self.by_id.items()}:
+                return False
+            self._replace(clubs)
+            self._touch()
+            self.revalidations += 1
+            return True
+
+    async def run_revalidation(self, interval: float) -> None:
+        """Periodically revalidate the cache, until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await self.revalidate():
+                    logger.info("Clubs cache is reloaded because the database was changed")
+            except Exception as e:
+                logger.warning(f"Failed to revalidate the clubs cache: {e!r}")
+
+    def list_snapshot(self) -> ClubsListSnapshot:
+        """Serialized list of all clubs, rebuilt only after mutations. The cache must be loaded."""
+        if self._list_snapshot is None:
+            self._list_snapshot = ClubsListSnapshot.build(list(self.by_id.values()))
+        return self._list_snapshot
+
+    def club_etag(self, club: Club) -> str:
+        """Content-hash ETag of the club, computed once per club mutation. The club must be taken from the cache."""
+        etag = self._etags.get(club.id)
+        if etag is None:
+            etag = self._etags[club.id] = make_etag(club.model_dump_json(by_alias=True).encode())
+        return etag
+
+    def put(self, club: Club) -> None:
+        self._touch()
+        if not self.loaded:
+            return
+        old = self.by_id.get(club.id)
+        if old is not None:
+            self._remove(old)
+        self._add(club)
+
+    def remove(self, id: PydanticObjectId) -> None:
+        self._touch()
+        if not self.loaded:
+            return
+        old = self.by_id.pop(id, None)
+        if old is not None:
+            self._remove(old)
+
+    def invalidate(self) -> None:
+        self._touch()
+        self.loaded = False
+        self.by_id, self.by_slug, self.by_leader, self._etags = {}, {}, {}, {}
+        self.search_index = SearchIndex()
+
+    def stats(self) -> ClubsCacheStats:
+        return ClubsCacheStats(
+            loaded=self.loaded,
+            size=len(self.by_id),
+            hits=self.hits,
+            misses=self.misses,
+            loads=self.loads,
+            revalidations=self.revalidations,
+            version=self.version,
+        )
+
+    def _count(self, club: Club | None) -> Club | None:
+        if club is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return club
+
+    def _replace(self, clubs: list[Club]) -> None:
+        self.by_id, self.by_slug, self.by_leader, self._etags = {}, {}, {}, {}
+        self.search_index = SearchIndex()
+        for club in clubs:
+            self._add(club)
+
+    def _touch(self) -> None:
+        self.version += 1
+        self.last_modified = datetime.datetime.now(datetime.UTC)
+        self._list_snapshot = None
+
+    def _add(self, club: Club) -> None:
+        self.by_id[club.id] = club
+        self.by_slug[club.slug] = club
+        if club.leader_innohassle_id:
+            self.by_leader.setdefault(club.leader_innohassle_id, []).append(club)
+        self.search_index.add(
+            club.id,
+            {"title": club.title, "short_description": club.short_description, "description": club.description},
+        )
+
+    def _remove(self, club: Club) -> None:
+        self._etags.pop(club.id, None)
+        self.search_index.remove(club.id)
+        if self.by_slug.get(club.slug) is club:
+            del self.by_slug[club.slug]
+        if club.leader_innohassle_id and club.leader_innohassle_id in self.by_leader:
+            led = [c for c in self.by_leader[club.leader_innohassle_id] if c.id != club.id]
+            if led:
+                self.by_leader[club.leader_innohassle_id] = led
+            else:
+                del self.by_leader[club.leader_innohassle_id]
+
+
+cache: ClubsCache = ClubsCache()
+"Clubs cache, objects from it are shared between requests and must not be modified in place"
+
+
+async def create(data: CreateClub, leader: LeaderSnapshot | None = None) -> Club:
+    club = Club.model_validate(data, from_attributes=True)
+    club.leader = leader
+    club = await club.create()
+    cache.put(club)
+    return club
+
+
+def _validation_error_reason(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, e['loc'])) or 'club'}: {e['msg']}" for e in error.errors())
+
+
+async def bulk_upsert(data: list[dict]) -> list[BulkUpsertResult]:
+    """
+    Validate and create or update clubs by slug with a single unordered bulk write.
+    Failure of one club (including an invalid one) does not prevent others from being saved.
+    """
+    results: list[BulkUpsertResult | None] = [None] * len(data)
+    items: list[CreateClub | None] = [None] * len(data)
+    operations: list[UpdateOne] = []
+    operation_to_item: list[int] = []
+    seen_slugs = set()
+    await cache.ensure_loaded()
+    for i, raw in enumerate(data):
+        try:
+            item = items[i] = CreateClub.model_validate(raw)
+        except ValidationError as e:
+            slug = raw.get("slug")
+            results[i] = BulkUpsertResult(
+                slug=slug if isinstance(slug, str) else None,
+                status=BulkUpsertStatus.FAILED,
+                reason=_validation_error_reason(e),
+            )
+            continue
+        if item.slug in seen_slugs:
+            results[i] = BulkUpsertResult(
+                slug=item.slug, status=BulkUpsertStatus.FAILED, reason="Duplicate slug in the request"
+            )
+            continue
+        seen_slugs.add(item.slug)
+        fields = item.model_dump(include=set(ClubSchema.model_fields))
+        if _has_outdated_leader(cache.by_slug.get(item.slug), item.leader_innohassle_id):
+            fields["leader"] = None
+        operations.append(UpdateOne({"slug": item.slug}, {"$set": fields}, upsert=True))
+        operation_to_item.append(i)
+
+    upserted: dict[int, PydanticObjectId] = {}
+    errors: dict[int, str] = {}
+    if operations:
+        try:
+            result = await Club.get_motor_collection().bulk_write(operations, ordered=False)
+            upserted = result.upserted_ids
+        except BulkWriteError as e:
+            upserted = {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
+            errors = {error["index"]: error["errmsg"] for error in e.details.get("writeErrors", [])}
+        finally:
+            cache.invalidate()
+        await cache.ensure_loaded()
+
+    for operation_index, i in enumerate(operation_to_item):
+        slug = items[i].slug
+        if operation_index in errors:
+            results[i] = BulkUpsertResult(slug=slug, status=BulkUpsertStatus.FAILED, reason=errors[operation_index])
+        elif operation_index in upserted:
+            results[i] = BulkUpsertResult(slug=slug, status=BulkUpsertStatus.CREATED, id=upserted[operation_index])
+        else:
+            club = cache.by_slug.get(slug)
+            results[i] = BulkUpsertResult(slug=slug, status=BulkUpsertStatus.UPDATED, id=club.id if club else None)
+    return results
 
 
 async def read(id: PydanticObjectId) -> Club | None:
-    return await Club.get(id)
+    await cache.ensure_loaded()
+    return cache.get_by_id(id)
 
 
 async def read_by_slug(slug: str) -> Club | None:
-    return await Club.find_one(Club.slug == slug)
+    await cache.ensure_loaded()
+    return cache.get_by_slug(slug)
+
+
+async def read_many(ids: list[PydanticObjectId], slugs: list[str]) -> ClubsBatchResponse:
+    await cache.ensure_loaded()
+    return ClubsBatchResponse(
+        by_id={str(id): cache.get_by_id(id) for id in ids},
+        by_slug={slug: cache.get_by_slug(slug) for slug in slugs},
+    )
 
 
 async def read_by_leader_innohassle_id(leader_innohassle_id: str) -> list[Club] | None:
-    return await Club.find(Club.leader_innohassle_id == leader_innohassle_id).to_list()
+    await cache.ensure_loaded()
+    return list(cache.by_leader.get(leader_innohassle_id, []))
 
 
 async def read_all() -> list[Club]:
-    return await Club.all().to_list()
+    await cache.ensure_loaded()
+    return list(cache.by_id.values())
+
+
+async def read_all_snapshot() -> ClubsListSnapshot:
+    await cache.ensure_loaded()
+    return cache.list_snapshot()
+
+
+async def search(query: str, limit: int) -> list[Club]:
+    await cache.ensure_loaded()
+    return [cache.by_id[id] for id in cache.search_index.search(query, limit)]
+
+
+EXPORT_BATCH_SIZE = 100
+"Number of clubs fetched from the database at once during export"
+
+
+async def export_ndjson() -> AsyncIterator[bytes]:
+    """Stream all clubs as newline-delimited JSON, without loading the whole collection into memory."""
+    async for club in Club.find_all(batch_size=EXPORT_BATCH_SIZE).sort(+Club.id):
+        yield club.model_dump_json(by_alias=True).encode() + b"\n"
+
+
+async def read_filtered(
+    type: ClubType | None = None,
+    is_active: bool | None = None,
+    sport_id: str | None = None,
+    limit: int | None = None,
+    after: PydanticObjectId | None = None,
+    projection_model: type[ClubCard] | None = None,
+) -> list[Club] | list[ClubCard]:
+    """
+    Read clubs matching the filters, sorted by id.
+    Use the id of the last club as `after` to get the next page (keyset pagination).
+    If `projection_model` is given, only its fields are fetched from the database.
+    """
+    filters = []
+    if is_active is not None:
+        filters.append(Club.is_active == is_active)
+    if type is not None:
+        filters.append(Club.type == type)
+    if sport_id is not None:
+        filters.append(Club.sport_id == sport_id)
+    if after is not None:
+        filters.append(Club.id > after)
+    query = Club.find(*filters).sort(+Club.id)
+    if limit is not None:
+        query = query.limit(limit)
+    if projection_model is not None:
+        return await query.project(projection_model).to_list()
+    return await query.to_list()
+
+
+async def _find_one_and_set(query: dict, fields: dict) -> Club | None:
+    """Set fields of the club in one round trip and return the updated club."""
+    if not fields:
+        club = await Club.find_one(query)
+    else:
+        club = await Club.find_one(query).update({"$set": fields}, response_type=UpdateResponse.NEW_DOCUMENT)
+        if club is not None:
+            cache.put(club)
+    return club
+
+
+def _has_outdated_leader(club: Club | None, leader_innohassle_id: str | None) -> bool:
+    """True if the club has a snapshot of a leader other than the given one."""
+    return club is not None and club.leader is not None and club.leader.innohassle_id != leader_innohassle_id
+
+
+def _with_leader(fields: dict, leader: LeaderSnapshot | None, current: Club | None) -> dict:
+    """
+    Set the new leader snapshot if it is given. If the leader is changed (or removed) and there is no snapshot
+    of the new one yet, the snapshot of the previous leader is removed in the same update: it must not be shown
+    as the club leader. The missing snapshot is fetched in the background.
+    """
+    if leader is not None:
+        fields["leader"] = leader.model_dump()
+    elif "leader_innohassle_id" in fields and _has_outdated_leader(current, fields["leader_innohassle_id"]):
+        fields["leader"] = None
+    return fields
+
+
+async def update(id: PydanticObjectId, data: ClubSchema, leader: LeaderSnapshot | None = None) -> Club | None:
+    await cache.ensure_loaded()
+    fields = data.model_dump(include=set(ClubSchema.model_fields))
+    return await _find_one_and_set({"_id": id}, _with_leader(fields, leader, cache.by_id.get(id)))
+
+
+async def update_by_slug(slug: str, data: ClubSchema, leader: LeaderSnapshot | None = None) -> Club | None:
+    await cache.ensure_loaded()
+    fields = data.model_dump(include=set(ClubSchema.model_fields))
+    return await _find_one_and_set({"slug": slug}, _with_leader(fields, leader, cache.by_slug.get(slug)))
+
+
+async def patch(id: PydanticObjectId, data: PatchClub, leader: LeaderSnapshot | None = None) -> Club | None:
+    await cache.ensure_loaded()
+    return await _find_one_and_set({"_id": id}, _with_leader(data.changed_fields(), leader, cache.by_id.get(id)))
+
+
+async def patch_by_slug(slug: str, data: PatchClub, leader: LeaderSnapshot | None = None) -> Club | None:
+    await cache.ensure_loaded()
+    fields = _with_leader(data.changed_fields(), leader, cache.by_slug.get(slug))
+    return await _find_one_and_set({"slug": slug}, fields)
+
+
+async def set_leader_snapshots(snapshots: list[LeaderSnapshot]) -> int:
+    """
+    Save fresh leader snapshots to all clubs led by these leaders with one bulk write.
+    Returns the number of updated clubs.
+    """
+    if not snapshots:
+        return 0
+    # Clubs are matched by the leader id, so a leader changed concurrently is not overwritten
+    operations = [
+        UpdateMany({"leader_innohassle_id": snapshot.innohassle_id}, {"$set": {"leader": snapshot.model_dump()}})
+        for snapshot in snapshots
+    ]
+    result = await Club.get_motor_collection().bulk_write(operations, ordered=False)
+    await cache.ensure_loaded()
+    for snapshot in snapshots:
+        for club in list(cache.by_leader.get(snapshot.innohassle_id, [])):
+            cache.put(club.model_copy(update={"leader": snapshot}))
+    return result.modified_count
+
+
+async def clear_outdated_leader_snapshots() -> int:
+    """
+    Remove snapshots of previous leaders from clubs whose leader was changed or removed.
+    Returns the number of updated clubs.
+    """
+    await cache.ensure_loaded()
+    outdated = [club for club in cache.by_id.values() if _has_outdated_leader(club, club.leader_innohassle_id)]
+    if not outdated:
+        return 0
+    # Clubs are matched by the leader id too, so a snapshot saved concurrently with a new leader is kept
+    operations = [
+        UpdateOne(
+            {
+                "_id": club.id,
+                "leader_innohassle_id": club.leader_innohassle_id,
+                "leader.innohassle_id": club.leader.innohassle_id,
+            },
+            {"$set": {"leader": None}},
+        )
+        for club in outdated
+    ]
+    result = await Club.get_motor_collection().bulk_write(operations, ordered=False)
+    for club in outdated:
+        if cache.by_id.get(club.id) is club:  # Not changed concurrently
+            cache.put(club.model_copy(update={"leader": None}))
+    return result.modified_count
 
 
-async def update(id: PydanticObjectId, data: ClubSchema) -> Club | None:
-    obj = await Club.get(id)
-    if obj:
-        await obj.set(data.model_dump())
-    return obj
+async def set_logo_file_id(id: PydanticObjectId, logo_file_id: str) -> Club | None:
+    return await _find_one_and_set({"_id": id}, {"logo_file_id": logo_file_id})
 
 
 async def delete(id: PydanticObjectId) -> bool:
     result = await Club.find_one({"_id": id}).delete()
+    cache.remove(id)
     return result and (result.deleted_count > 0)
@@ -0,0 +1,111 @@
+"""
+Processing of club logos outside the event loop.
+"""
+
+__all__ = [
+    "LogoProcessor",
+    "LogoProcessorBusyError",
+    "LogoProcessorUnavailableError",
+    "ProcessedLogo",
+    "logo_processor",
+    "process_logo",
+]
+
+import asyncio
+import time
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import pyvips
+
+from src.config import settings
+from src.config_schema import ExecutorType, LogoProcessing
+from src.logging_ import logger
+
+LOGO_SIZES = (None, 512)
+"Sizes of stored logo variants (None is the original size)"
+
+
+@dataclass
+class ProcessedLogo:
+    variants: dict[int | None, bytes]
+    "WebP image by size"
+    timings: dict[str, float] = field(default_factory=dict)
+    "Duration of each processing stage in seconds"
+
+
+class LogoProcessorUnavailableError(Exception):
+    """Logo cannot be processed now, the upload may be retried later"""
+
+
+class LogoProcessorBusyError(LogoProcessorUnavailableError):
+    """Too many logos are being processed already"""
+
+
+def process_logo(data: bytes) -> ProcessedLogo:
+    """Convert the image to WebP and make a 512px thumbnail. Blocking, runs in a worker."""
+    timings = {}
+    start = time.perf_counter()
+    image: pyvips.Image = pyvips.Image.new_from_buffer(data, "")
+    image_bytes = image.write_to_buffer(".webp")
+    timings["convert"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    image_512: pyvips.Image = pyvips.Image.thumbnail_buffer(data, 512, height=512)
+    image_512_bytes = image_512.write_to_buffer(".webp[Q=95,min-size]")
+    timings["thumbnail"] = time.perf_counter() - start
+    return ProcessedLogo(variants={None: image_bytes, 512: image_512_bytes}, timings=timings)
+
+
+class LogoProcessor:
+    """
+    Runs `process_logo` in a pool of `max_workers` processes or threads.
+    At most `max_queue` logos may wait for a free worker, further ones are rejected right away.
+    """
+
+    def __init__(self, config: LogoProcessing):
+        self.config = config
+        self.pending = 0
+        "Number of logos being processed or waiting for a worker"
+        self.rejected = 0
+        self._executor: Executor | None = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.config.executor == ExecutorType.PROCESS:
+                self._executor = ProcessPoolExecutor(max_workers=self.config.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.config.max_workers, thread_name_prefix="logo")
+        return self._executor
+
+    async def process(self, data: bytes) -> ProcessedLogo:
+        if self.pending >= self.config.max_workers + self.config.max_queue:
+            self.rejected += 1
+            raise LogoProcessorBusyError("Too many logos are being processed, retry later")
+        self.pending += 1
+        try:
+            start = time.perf_counter()
+            executor = self.executor
+            logo = await asyncio.get_running_loop().run_in_executor(executor, process_logo, data)
+            total = time.perf_counter() - start
+        except BrokenExecutor:
+            # A worker died (e.g. crashed or was killed for memory on a huge image), so the pool is unusable
+            logger.error("Logo processing worker died, restarting the pool")
+            if self._executor is executor:
+                self.shutdown()
+            raise LogoProcessorUnavailableError("Logo processing failed, retry later")
+        finally:
+            self.pending -= 1
+        logo.timings["queue"] = total - sum(logo.timings.values())
+        stages = ", ".join(f"{stage} {duration * 1000:.0f} ms" for stage, duration in logo.timings.items())
+        logger.info(f"Processed logo ({len(data)} bytes) in {total * 1000:.0f} ms: {stages}")
+        return logo
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+logo_processor: LogoProcessor = LogoProcessor(settings.logo_processing)
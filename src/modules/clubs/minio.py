@@ -1,8 +1,11 @@
+import asyncio
 import io
+import time
 from urllib.parse import urlunsplit
 
 from src.config import settings
-from src.storages.minio import minio_client
+from src.logging_ import logger
+from src.storages.minio import minio_client, minio_executor
 
 
 def get_club_logo_object_name(logo_file_id: str, size: int | None = None):
@@ -32,3 +35,17 @@ def put_club_logo(logo_file_id: str, size: int | None, data: bytes, content_type
         length=len(data),
         content_type=content_type,
     )
+
+
+async def put_club_logos(logo_file_id: str, variants: dict[int | None, bytes], content_type: str) -> None:
+    """Upload all logo variants (by size) concurrently without blocking the event loop and log their latencies."""
+    loop = asyncio.get_running_loop()
+
+    async def put(size: int | None, data: bytes) -> None:
+        start = time.perf_counter()
+        await loop.run_in_executor(minio_executor, put_club_logo, logo_file_id, size, data, content_type)
+        duration = time.perf_counter() - start
+        object_name = get_club_logo_object_name(logo_file_id, size)
+        logger.info(f"Uploaded {object_name} ({len(data)} bytes) in {duration * 1000:.0f} ms")
+
+    await asyncio.gather(*(put(size, data) for size, data in variants.items()))
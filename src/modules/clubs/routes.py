@@ -1,18 +1,25 @@
-import beanie.exceptions
+from typing import Annotated, Literal
+
 import magic
-import pyvips
 from beanie import PydanticObjectId
-from fastapi import APIRouter, HTTPException, UploadFile
+from fastapi import APIRouter, Body, HTTPException, Query, Request, UploadFile
 from fastapi_derive_responses import AutoDeriveResponsesAPIRoute
+from pymongo.errors import DuplicateKeyError
 from starlette import status
-from starlette.responses import RedirectResponse
+from starlette.responses import RedirectResponse, Response, StreamingResponse
 
 import src.modules.clubs.crud as c
 import src.modules.clubs.minio as clubs_minio
+import src.modules.leaders.crud as leaders_crud
 from src.api import docs
+from src.api.conditional import is_not_modified, not_modified_response, validator_headers
 from src.api.dependencies import REQUIRE_ADMIN
-from src.modules.inh_accounts_sdk import inh_accounts
+from src.modules.clubs.logo import LogoProcessorUnavailableError, logo_processor
+from src.modules.inh_accounts_sdk import UserSchema, inh_accounts
 from src.storages.mongo import Club
+from src.storages.mongo.club import ClubType, LeaderSnapshot
+
+_EXPAND_DESCRIPTION = "`leader` fills `leader` of each club with up-to-date leader info"
 
 router = APIRouter(
     prefix="/clubs",
@@ -25,15 +32,120 @@ Clubs list and management.
 docs.TAGS_INFO.append({"description": _description, "name": str(router.tags[0])})
 
 
+def _choose_encoding(accept_encoding: str | None) -> str | None:
+    """Choose the best of supported encodings (br, gzip) from the `Accept-Encoding` header."""
+    if not accept_encoding:
+        return None
+    accepted = set()
+    for item in accept_encoding.split(","):
+        coding, *params = (part.strip() for part in item.split(";"))
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(coding.lower())
+    for coding in ("br", "gzip"):
+        if coding in accepted:
+            return coding
+    return None
+
+
 @router.get(
     "/",
     responses={
         status.HTTP_200_OK: {"description": "List of clubs"},
+        status.HTTP_304_NOT_MODIFIED: {"description": "List of clubs is not modified"},
+        status.HTTP_400_BAD_REQUEST: {"description": "Leaders cannot be expanded in the card view"},
     },
+    response_model=list[Club] | list[c.ClubCard],
 )
-async def get_clubs_list() -> list[Club]:
-    """Get list of clubs."""
-    return await c.read_all()
+async def get_clubs_list(
+    request: Request,
+    type: ClubType | None = None,
+    is_active: bool | None = None,
+    sport_id: str | None = None,
+    limit: int | None = Query(None, ge=1, le=1000, description="Max number of clubs to return"),
+    after: PydanticObjectId | None = Query(None, description="Return clubs with id greater than this one"),
+    view: Literal["full", "card"] = Query("full", description="`card` returns only fields needed for club cards"),
+    expand: Literal["leader"] | None = Query(None, description=_EXPAND_DESCRIPTION),
+) -> Response | list[Club] | list[c.ClubCard]:
+    """
+    Get list of clubs.
+
+    Clubs are sorted by id. To get the next page, pass the id of the last received club as `after`.
+    """
+    if expand == "leader":
+        if view == "card":
+            raise HTTPException(status_code=400, detail="Leaders cannot be expanded in the card view")
+        if any(param is not None for param in (type, is_active, sport_id, limit, after)):
+            clubs = await c.read_filtered(type=type, is_active=is_active, sport_id=sport_id, limit=limit, after=after)
+        else:
+            clubs = await c.read_all()
+        return await leaders_crud.with_leaders(clubs)
+
+    if view == "card" or any(param is not None for param in (type, is_active, sport_id, limit, after)):
+        return await c.read_filtered(
+            type=type,
+            is_active=is_active,
+            sport_id=sport_id,
+            limit=limit,
+            after=after,
+            projection_model=c.ClubCard if view == "card" else None,
+        )
+
+    snapshot = await c.read_all_snapshot()
+    headers = {"Vary": "Accept-Encoding", **validator_headers(snapshot.etag, c.cache.last_modified)}
+    if is_not_modified(request.headers, snapshot.etag, c.cache.last_modified):
+        return not_modified_response(headers)
+    match _choose_encoding(request.headers.get("accept-encoding")):
+        case "br":
+            body = snapshot.br
+            headers["Content-Encoding"] = "br"
+        case "gzip":
+            body = snapshot.gzip
+            headers["Content-Encoding"] = "gzip"
+        case _:
+            body = snapshot.json
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get(
+    "/export.ndjson",
+    responses={
+        status.HTTP_200_OK: {
+            "description": "All clubs, one JSON object per line",
+            "content": {"application/x-ndjson": {}},
+        },
+        status.HTTP_403_FORBIDDEN: {"description": "Only admin can export clubs"},
+    },
+    response_class=StreamingResponse,
+)
+async def export_clubs(_: REQUIRE_ADMIN) -> StreamingResponse:
+    """Export all clubs from the database in NDJSON format."""
+    return StreamingResponse(
+        c.export_ndjson(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="clubs.ndjson"'},
+    )
+
+
+@router.get(
+    "/search",
+    responses={
+        status.HTTP_200_OK: {"description": "Clubs matching the query, the most relevant first"},
+    },
+)
+async def search_clubs(
+    q: str = Query(..., min_length=1, max_length=200, description="Search query, the last word may be incomplete"),
+    limit: int = Query(20, ge=1, le=100),
+) -> list[Club]:
+    """Search clubs by title and descriptions."""
+    return await c.search(q, limit)
 
 
 @router.post(
@@ -45,43 +157,122 @@ async def get_clubs_list() -> list[Club]:
 )
 async def create_club(club_info: c.CreateClub, _: REQUIRE_ADMIN) -> Club:
     """Create a new club."""
-    return await c.create(club_info)
+    return await c.create(club_info, leader=await _leader_snapshot(club_info.leader_innohassle_id))
+
+
+@router.post(
+    "/bulk",
+    responses={
+        status.HTTP_200_OK: {"description": "Result for each club, in the same order"},
+        status.HTTP_403_FORBIDDEN: {"description": "Only admin can import clubs"},
+    },
+)
+async def bulk_upsert_clubs(
+    clubs: Annotated[list[dict], Body(max_length=1000)], _: REQUIRE_ADMIN
+) -> list[c.BulkUpsertResult]:
+    """
+    Create or update many clubs at once, matching them by slug.
+    Each item has the same fields as in `POST /clubs/`; invalid items are reported as failed, others are saved.
+    """
+    return await c.bulk_upsert(clubs)
+
+
+@router.post(
+    "/batch",
+    responses={
+        status.HTTP_200_OK: {"description": "Requested clubs"},
+    },
+)
+async def get_clubs_batch(request: c.ClubsBatchRequest) -> c.ClubsBatchResponse:
+    """Get many clubs by ids and/or slugs at once."""
+    return await c.read_many(request.ids, request.slugs)
 
 
 @router.get(
     "/by-id/{id}",
     responses={
         status.HTTP_200_OK: {"description": "Club info"},
+        status.HTTP_304_NOT_MODIFIED: {"description": "Club info is not modified"},
         status.HTTP_404_NOT_FOUND: {"description": "Club not found"},
     },
 )
-async def get_club_info(id: PydanticObjectId) -> Club:
+async def get_club_info(
+    id: PydanticObjectId,
+    request: Request,
+    response: Response,
+    expand: Literal["leader"] | None = Query(None, description=_EXPAND_DESCRIPTION),
+) -> Club:
     """Get club info."""
     club = await c.read(id)
     if not club:
         raise HTTPException(status_code=404, detail="Club not found")
-    return club
+    if expand == "leader":
+        (club,) = await leaders_crud.with_leaders([club])
+        return club
+    return _club_conditional_response(club, request, response)
 
 
 @router.get(
     "/by-slug/{slug}",
     responses={
         status.HTTP_200_OK: {"description": "Club info"},
+        status.HTTP_304_NOT_MODIFIED: {"description": "Club info is not modified"},
         status.HTTP_404_NOT_FOUND: {"description": "Club not found"},
     },
 )
-async def get_club_info_by_slug(slug: str) -> Club:
+async def get_club_info_by_slug(
+    slug: str,
+    request: Request,
+    response: Response,
+    expand: Literal["leader"] | None = Query(None, description=_EXPAND_DESCRIPTION),
+) -> Club:
     """Get club info."""
     club = await c.read_by_slug(slug)
     if not club:
         raise HTTPException(status_code=404, detail="Club not found")
+    if expand == "leader":
+        (club,) = await leaders_crud.with_leaders([club])
+        return club
+    return _club_conditional_response(club, request, response)
+
+
+def _club_conditional_response(club: Club, request: Request, response: Response) -> Club | Response:
+    headers = validator_headers(c.cache.club_etag(club), c.cache.last_modified)
+    if is_not_modified(request.headers, c.cache.club_etag(club), c.cache.last_modified):
+        return not_modified_response(headers)
+    response.headers.update(headers)
     return club
 
 
+async def _resolve_new_leader_email(email: str) -> UserSchema:
+    new_leader_data = await inh_accounts.get_user(email=email)
+    if not new_leader_data:
+        raise HTTPException(status_code=404, detail="New leader email not found")
+    return new_leader_data
+
+
+async def _leader_snapshot(
+    leader_innohassle_id: str | None, user: UserSchema | None = None, current: Club | None = None
+) -> LeaderSnapshot | None:
+    """
+    Snapshot of the new club leader to embed in the club.
+    None if the snapshot should be kept as is: the leader is not changed or the profile is not available now.
+    """
+    if not leader_innohassle_id:
+        return None
+    if user is None and current is not None and current.leader and current.leader.innohassle_id == leader_innohassle_id:
+        return None
+    leader = (
+        leaders_crud.leader_from_user(user) if user else await leaders_crud.read_by_innohassle_id(leader_innohassle_id)
+    )
+    return leaders_crud.snapshot_from_leader(leader) if leader else None
+
+
 @router.post(
     "/by-id/{id}",
     responses={
         status.HTTP_200_OK: {"description": "Changed club info successfully"},
+        status.HTTP_400_BAD_REQUEST: {"description": "Slug already exists"},
         status.HTTP_403_FORBIDDEN: {"description": "Only admin can change club info"},
         status.HTTP_404_NOT_FOUND: {"description": "Club not found"},
     },
@@ -89,14 +280,17 @@ async def get_club_info_by_slug(slug: str) -> Club:
 async def edit_club_info(id: PydanticObjectId, club_info: c.UpdateClub, _: REQUIRE_ADMIN) -> Club:
     """Edit a club info."""
     # TODO: Allow club leaders to edit some info
+    new_leader = None
     if club_info.new_leader_email:
-        new_leader_data = await inh_accounts.get_user(email=club_info.new_leader_email)
-        if not new_leader_data:
-            raise HTTPException(status_code=404, detail="New leader email not found")
-        club_info.leader_innohassle_id = new_leader_data.id
+        new_leader = await _resolve_new_leader_email(club_info.new_leader_email)
+        club_info.leader_innohassle_id = new_leader.id
         club_info.new_leader_email = None
+    leader = await _leader_snapshot(club_info.leader_innohassle_id, new_leader, await c.read(id))
 
-    club = await c.update(id, club_info)
+    try:
+        club = await c.update(id, club_info, leader=leader)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Slug already exists")
     if club is None:
         raise HTTPException(status_code=404, detail="Club not found")
     return club
@@ -114,20 +308,76 @@ async def edit_club_info(id: PydanticObjectId, club_info: c.UpdateClub, _: REQUI
 async def edit_club_info_by_slug(slug: str, club_info: c.UpdateClub, _: REQUIRE_ADMIN) -> Club:
     """Edit a club info."""
     # TODO: Allow club leaders to edit some info
+    new_leader = None
     if club_info.new_leader_email:
-        new_leader_data = await inh_accounts.get_user(email=club_info.new_leader_email)
-        if not new_leader_data:
-            raise HTTPException(status_code=404, detail="New leader email not found")
-        club_info.leader_innohassle_id = new_leader_data.id
+        new_leader = await _resolve_new_leader_email(club_info.new_leader_email)
+        club_info.leader_innohassle_id = new_leader.id
         club_info.new_leader_email = None
+    leader = await _leader_snapshot(club_info.leader_innohassle_id, new_leader, await c.read_by_slug(slug))
 
-    club = await c.read_by_slug(slug)
-    if not club:
+    try:
+        club = await c.update_by_slug(slug, club_info, leader=leader)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Slug already exists")
+    if club is None:
         raise HTTPException(status_code=404, detail="Club not found")
+    return club
+
+
+@router.patch(
+    "/by-id/{id}",
+    responses={
+        status.HTTP_200_OK: {"description": "Changed club info successfully"},
+        status.HTTP_400_BAD_REQUEST: {"description": "Slug already exists"},
+        status.HTTP_403_FORBIDDEN: {"description": "Only admin can change club info"},
+        status.HTTP_404_NOT_FOUND: {"description": "Club not found"},
+    },
+)
+async def patch_club_info(id: PydanticObjectId, club_info: c.PatchClub, _: REQUIRE_ADMIN) -> Club:
+    """Change only the provided fields of a club info."""
+    new_leader = None
+    if club_info.new_leader_email:
+        new_leader = await _resolve_new_leader_email(club_info.new_leader_email)
+        club_info.leader_innohassle_id = new_leader.id
+    leader = None
+    if "leader_innohassle_id" in club_info.model_fields_set:
+        leader = await _leader_snapshot(club_info.leader_innohassle_id, new_leader, await c.read(id))
+
     try:
-        return await c.update(club.id, club_info)
-    except beanie.exceptions.RevisionIdWasChanged:
+        club = await c.patch(id, club_info, leader=leader)
+    except DuplicateKeyError:
         raise HTTPException(status_code=400, detail="Slug already exists")
+    if club is None:
+        raise HTTPException(status_code=404, detail="Club not found")
+    return club
+
+
+@router.patch(
+    "/by-slug/{slug}",
+    responses={
+        status.HTTP_200_OK: {"description": "Changed club info successfully"},
+        status.HTTP_400_BAD_REQUEST: {"description": "Slug already exists"},
+        status.HTTP_403_FORBIDDEN: {"description": "Only admin can change club info"},
+        status.HTTP_404_NOT_FOUND: {"description": "Club not found"},
+    },
+)
+async def patch_club_info_by_slug(slug: str, club_info: c.PatchClub, _: REQUIRE_ADMIN) -> Club:
+    """Change only the provided fields of a club info."""
+    new_leader = None
+    if club_info.new_leader_email:
+        new_leader = await _resolve_new_leader_email(club_info.new_leader_email)
+        club_info.leader_innohassle_id = new_leader.id
+    leader = None
+    if "leader_innohassle_id" in club_info.model_fields_set:
+        leader = await _leader_snapshot(club_info.leader_innohassle_id, new_leader, await c.read_by_slug(slug))
+
+    try:
+        club = await c.patch_by_slug(slug, club_info, leader=leader)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Slug already exists")
+    if club is None:
+        raise HTTPException(status_code=404, detail="Club not found")
+    return club
 
 
 @router.delete(
@@ -140,7 +390,7 @@ async def edit_club_info_by_slug(slug: str, club_info: c.UpdateClub, _: REQUIRE_
 )
 async def delete_club(id: PydanticObjectId, _: REQUIRE_ADMIN) -> None:
     """Delete a club."""
-    result = c.delete(id)
+    result = await c.delete(id)
     if not result:
         raise HTTPException(status_code=404, detail="Club not found")
 
@@ -153,7 +403,7 @@ async def delete_club(id: PydanticObjectId, _: REQUIRE_ADMIN) -> None:
     },
     response_model=None,
 )
-async def get_club_logo(id: str):
+async def get_club_logo(id: PydanticObjectId):
     """Get club info."""
     club = await c.read(id)
     if not club:
@@ -172,6 +422,7 @@ async def get_club_logo(id: str):
         status.HTTP_400_BAD_REQUEST: {"description": "Invalid content type"},
         status.HTTP_403_FORBIDDEN: {"description": "Only admin can change club logo"},
         status.HTTP_404_NOT_FOUND: {"description": "Club not found"},
+        status.HTTP_503_SERVICE_UNAVAILABLE: {"description": "Logo cannot be processed now, retry later"},
     },
 )
 async def set_club_logo(id: PydanticObjectId, logo_file: UploadFile, _: REQUIRE_ADMIN) -> Club:
@@ -190,16 +441,20 @@ async def set_club_logo(id: PydanticObjectId, logo_file: UploadFile, _: REQUIRE_
         raise HTTPException(status_code=400, detail=f"Invalid content type ({content_type})")
 
     # Convert to webp and resize to 512
-    image: pyvips.Image = pyvips.Image.new_from_buffer(bytes_, "")
-    image_bytes = image.write_to_buffer(".webp")
-    image_512: pyvips.Image = pyvips.Image.thumbnail_buffer(bytes_, 512, height=512)
-    image_512_bytes = image_512.write_to_buffer(".webp[Q=95,min-size]")
+    try:
+        logo = await logo_processor.process(bytes_)
+    except LogoProcessorUnavailableError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(logo_processor.config.retry_after)},
+        )
 
     # Save file
     logo_file_id = str(PydanticObjectId())
-    clubs_minio.put_club_logo(logo_file_id, None, image_bytes, "image/webp")
-    clubs_minio.put_club_logo(logo_file_id, 512, image_512_bytes, "image/webp")
+    await clubs_minio.put_club_logos(logo_file_id, logo.variants, "image/webp")
 
-    club.logo_file_id = logo_file_id
-    await club.save()
+    club = await c.set_logo_file_id(id, logo_file_id)
+    if club is None:
+        raise HTTPException(status_code=404, detail="Club not found")
     return club
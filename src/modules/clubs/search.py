@@ -0,0 +1,137 @@
+"""
+In-memory full-text search over clubs.
+"""
+
+__all__ = ["SearchIndex", "tokenize"]
+
+import bisect
+import math
+import re
+from collections import defaultdict
+
+from beanie import PydanticObjectId
+
+_WORD_RE = re.compile(r"\w+")
+
+# Most common inflectional endings, longest first. This is not a real stemmer, but it is enough to match
+# "программирование" with "программировании", "секции" with "секция", "games" with "gaming" or "dance" with "dancing".
+_RUSSIAN_SUFFIXES = sorted(
+    (
+        "остями остям остях остью остей иями иях иям ией ием ями ами ого его ому ему ыми ими ость ости ых их ой ей "
+        "ий ый ая яя ое ее ые ие ую юю ов ев ам ям ах ях ом ем ым им ию ия ии ью ою ею ть ся а я о е ы и у ю ь й"
+    ).split(),
+    key=len,
+    reverse=True,
+)
+_ENGLISH_SUFFIXES = sorted("ations ation ings ing ed ly er".split(), key=len, reverse=True)
+_MIN_STEM_LENGTH = 3
+
+# Matches in the title are more important than in the description
+FIELD_WEIGHTS = {"title": 3.0, "short_description": 2.0, "description": 1.0}
+PREFIX_MATCH_FACTOR = 0.5
+"Score multiplier for terms that only start with the query term (autocomplete)"
+
+
+def _stem(word: str) -> str:
+    if any("а" <= ch <= "я" for ch in word):
+        for suffix in _RUSSIAN_SUFFIXES:
+            if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM_LENGTH:
+                return word[: -len(suffix)]
+        return word
+
+    # Plural forms: "activities" -> "activity", "matches" -> "match", "games" -> "game"
+    if word.endswith("ies") and len(word) > 4:
+        word = word[:-3] + "y"
+    elif word.endswith(("sses", "xes", "zes", "ches", "shes")):
+        word = word[:-2]
+    elif word.endswith("s") and not word.endswith(("ss", "us", "is")) and len(word) > 3:
+        word = word[:-1]
+    for suffix in _ENGLISH_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM_LENGTH:
+            word = word[: -len(suffix)]
+            # Doubled consonant: "running" -> "run", "programmer" -> "program"
+            if word[-1] == word[-2] and word[-1] not in "aeiouylsz":
+                word = word[:-1]
+            break
+    # Silent "e", so that "dance" and "game" match "dancing" and "gaming"
+    if word.endswith("e") and len(word) > _MIN_STEM_LENGTH:
+        word = word[:-1]
+    return word
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lowercase stemmed terms."""
+    return [_stem(word) for word in _WORD_RE.findall(text.lower().replace("ё", "е"))]
+
+
+class SearchIndex:
+    """
+    Inverted index (term -> club id -> weight) with a sorted list of terms for prefix matching.
+    Clubs are added and removed incrementally.
+    """
+
+    postings: dict[str, dict[PydanticObjectId, float]]
+    "Weighted term frequency of each term in each club"
+    terms: list[str]
+    "Sorted list of all indexed terms"
+
+    def __init__(self):
+        self.postings = {}
+        self.terms = []
+        self._club_terms: dict[PydanticObjectId, list[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._club_terms)
+
+    def add(self, club_id: PydanticObjectId, fields: dict[str, str]) -> None:
+        self.remove(club_id)
+        weights: dict[str, float] = defaultdict(float)
+        for field, text in fields.items():
+            for term in tokenize(text):
+                weights[term] += FIELD_WEIGHTS.get(field, 1.0)
+        for term, weight in weights.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                bisect.insort(self.terms, term)
+            posting[club_id] = weight
+        self._club_terms[club_id] = list(weights)
+
+    def remove(self, club_id: PydanticObjectId) -> None:
+        for term in self._club_terms.pop(club_id, []):
+            posting = self.postings[term]
+            del posting[club_id]
+            if not posting:
+                del self.postings[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+
+    def search(self, query: str, limit: int) -> list[PydanticObjectId]:
+        """
+        Find clubs that match all terms of the query, ordered by relevance.
+        Every query term also matches indexed terms starting with it.
+        """
+        query_terms = set(tokenize(query))
+        if not query_terms:
+            return []
+        total = len(self._club_terms)
+        scores: dict[PydanticObjectId, float] | None = None
+        for query_term in query_terms:
+            term_scores: dict[PydanticObjectId, float] = defaultdict(float)
+            i = bisect.bisect_left(self.terms, query_term)
+            while i < len(self.terms) and self.terms[i].startswith(query_term):
+                term = self.terms[i]
+                posting = self.postings[term]
+                idf = math.log(1 + total / len(posting))
+                factor = 1.0 if term == query_term else PREFIX_MATCH_FACTOR
+                for club_id, weight in posting.items():
+                    term_scores[club_id] = max(term_scores[club_id], weight * idf * factor)
+                i += 1
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {
+                    club_id: score + term_scores[club_id] for club_id, score in scores.items() if club_id in term_scores
+                }
+            if not scores:
+                return []
+        return sorted(scores, key=scores.__getitem__, reverse=True)[:limit]
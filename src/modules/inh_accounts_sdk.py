@@ -1,5 +1,14 @@
+import asyncio
+import base64
 import datetime
+import hashlib
+import json
+import random
 import time
+from collections import OrderedDict
+from collections.abc import Callable, Coroutine
+from enum import StrEnum
+from typing import Any
 
 import httpx
 from authlib.jose import JsonWebKey, JWTClaims, KeySet, jwt
@@ -7,6 +16,8 @@ from authlib.jose.errors import JoseError
 from pydantic import BaseModel
 
 from src.config import settings
+from src.config_schema import Accounts
+from src.logging_ import logger
 
 
 class UserInfoFromSSO(BaseModel):
@@ -43,59 +54,406 @@ class UserTokenData(BaseModel):
     "User's Telegram ID connected to InNoHassle Accounts"
 
 
+class ConnectionPoolStats(BaseModel):
+    connections: int
+    "Number of open connections"
+    idle_connections: int
+    "Number of open connections not used by any request"
+    http2_connections: int
+    "Number of connections using HTTP/2"
+    queued_requests: int | None
+    "Number of requests waiting for a connection (None if unknown)"
+
+
+class TokenCacheStats(BaseModel):
+    size: int
+    "Number of cached tokens (including invalid ones)"
+    hits: int
+    "Number of tokens decoded from the cache"
+    negative_hits: int
+    "Number of tokens rejected from the cache as invalid"
+    misses: int
+    "Number of tokens verified with the key set"
+    evictions: int
+    "Number of tokens evicted from the cache because it is full"
+
+
+class TokenCache:
+    """
+    LRU cache of decoded user tokens by token hash.
+    Valid tokens are kept until they expire, invalid ones for `negative_ttl` seconds.
+    """
+
+    def __init__(self, max_size: int, negative_ttl: float):
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self.entries: OrderedDict[bytes, tuple[UserTokenData | None, float]] = OrderedDict()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def get(self, key: bytes) -> tuple[bool, UserTokenData | None]:
+        """Return (found, token data); token data is None for invalid tokens."""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        token_data, expires_at = entry
+        if time.time() >= expires_at:
+            del self.entries[key]
+            self.misses += 1
+            return False, None
+        self.entries.move_to_end(key)
+        if token_data is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return True, token_data
+
+    def put(self, key: bytes, token_data: UserTokenData | None, expires_at: float | None = None) -> None:
+        if token_data is None:
+            expires_at = time.time() + self.negative_ttl
+        self.entries[key] = (token_data, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def stats(self) -> TokenCacheStats:
+        return TokenCacheStats(
+            size=len(self.entries),
+            hits=self.hits,
+            negative_hits=self.negative_hits,
+            misses=self.misses,
+            evictions=self.evictions,
+        )
+
+
+class CircuitOpenError(httpx.HTTPError):
+    """Request to the Accounts API is not sent because the API is considered unavailable"""
+
+
+class CircuitState(StrEnum):
+    CLOSED = "closed"
+    "Requests are sent as usual"
+    OPEN = "open"
+    "Requests are rejected without being sent"
+    HALF_OPEN = "half_open"
+    "A single trial request is sent to check if the API has recovered"
+
+
+class CircuitBreakerStats(BaseModel):
+    state: CircuitState
+    "Current state of the circuit breaker"
+    consecutive_failures: int
+    "Number of failed requests in a row"
+    failures: int
+    "Total number of failed requests"
+    opened: int
+    "Number of times the circuit breaker was opened"
+    rejected: int
+    "Number of requests rejected without being sent"
+    retries: int
+    "Number of retried requests"
+    retries_over_budget: int
+    "Number of retries not made because the retry budget was exhausted"
+
+
+class CircuitBreaker:
+    """
+    Stops requests to an unavailable API after `failure_threshold` consecutive failures.
+    After `reset_timeout` a single trial request is let through: success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._trial_started_at = 0.0
+
+    def before_request(self) -> None:
+        """Raise `CircuitOpenError` if the request must not be sent."""
+        now = time.monotonic()
+        if self.state == CircuitState.OPEN and now - self._opened_at >= self.reset_timeout:
+            self.state = CircuitState.HALF_OPEN
+            self._trial_started_at = 0.0
+        if self.state == CircuitState.HALF_OPEN:
+            # Let another trial through if the previous one got lost (e.g. cancelled)
+            if now - self._trial_started_at < self.reset_timeout:
+                self.rejected += 1
+                raise CircuitOpenError("Accounts API is unavailable, waiting for the trial request")
+            self._trial_started_at = now
+        elif self.state == CircuitState.OPEN:
+            self.rejected += 1
+            raise CircuitOpenError("Accounts API is unavailable")
+
+    def record_success(self) -> None:
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.state == CircuitState.HALF_OPEN or (
+            self.state == CircuitState.CLOSED and self.consecutive_failures >= self.failure_threshold
+        ):
+            self.state = CircuitState.OPEN
+            self._opened_at = time.monotonic()
+            self.opened += 1
+
+
+class RetryBudget:
+    """Every request adds `ratio` to the budget and every retry takes 1, so retries are a bounded share of requests."""
+
+    def __init__(self, ratio: float, max_tokens: float):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
 class InNoHassleAccounts:
     api_url: str
     api_jwt_token: str
     PUBLIC_KID = "public"
-    key_set: KeySet
+    key_set: KeySet | None = None
+    keys: dict[str, JsonWebKey]
+    "Parsed public keys from the key set by kid"
+    _jwks_etag: str | None = None
+    _key_set_updated_at: float = float("-inf")
+    "Time of the last attempt to update the key set (monotonic)"
+    _client: httpx.AsyncClient | None = None
+    _in_flight: dict[tuple, asyncio.Task]
+    "Requests to the Accounts API that are currently running, for deduplication"
+    _batch: dict[str, asyncio.Future[UserSchema | None]]
+    "Single user lookups waiting to be sent in one bulk request"
+    _batch_timer: asyncio.TimerHandle | None = None
 
-    def __init__(self, api_url: str, api_jwt_token: str):
+    def __init__(self, api_url: str, api_jwt_token: str, config: Accounts | None = None):
         self.api_url = api_url
         self.api_jwt_token = api_jwt_token
+        self.config = config or Accounts(api_url=api_url, api_jwt_token=api_jwt_token)
+        self.keys = {}
+        self._in_flight = {}
+        self._batch = {}
+        self._batch_tasks: set[asyncio.Task] = set()
+        self.breaker = CircuitBreaker(self.config.breaker_failure_threshold, self.config.breaker_reset_timeout)
+        self.retry_budget = RetryBudget(self.config.retry_budget_ratio, self.config.retry_budget_max)
+        self.retries = 0
+        self.retries_over_budget = 0
+        self.token_cache = TokenCache(self.config.token_cache_size, self.config.token_cache_negative_ttl)
+
+    async def update_key_set(self) -> None:
+        """Fetch the key set; the request is conditional, so unchanged keys are not downloaded and parsed again."""
+        self._key_set_updated_at = time.monotonic()
+        headers = {"If-None-Match": self._jwks_etag} if self._jwks_etag and self.keys else {}
+        response = await self._request("GET", "/.well-known/jwks.json", timeout=self.config.timeout, headers=headers)
+        if response.status_code == 304:
+            return
+        response.raise_for_status()
+        key_set = JsonWebKey.import_key_set(response.json())
+        keys = {key.kid: key for key in key_set.keys}
+        if {kid: key.thumbprint() for kid, key in keys.items()} != {
+            kid: key.thumbprint() for kid, key in self.keys.items()
+        }:
+            # Tokens were verified with the previous keys
+            self.token_cache.clear()
+        self.key_set, self.keys = key_set, keys
+        self._jwks_etag = response.headers.get("ETag")
 
-    async def update_key_set(self):
-        self.key_set = await self.get_key_set()
+    async def run_key_set_refresher(self) -> None:
+        """Periodically refresh the key set, until cancelled."""
+        while True:
+            await asyncio.sleep(self.config.jwks_refresh_interval)
+            try:
+                await self._refresh_key_set()
+            except Exception as e:
+                logger.warning(f"Failed to refresh the key set of InNoHassle Accounts: {e!r}")
 
-    def get_public_key(self) -> JsonWebKey:
+    async def _refresh_key_set(self) -> None:
+        """Update the key set; concurrent callers share one request."""
+        await asyncio.shield(self._single_flight(("jwks",), self.update_key_set))
+
+    async def _refresh_key_set_on_miss(self) -> None:
+        """Update the key set because of an unknown kid, at most once per `jwks_min_refresh_interval`."""
+        if ("jwks",) not in self._in_flight:
+            if time.monotonic() - self._key_set_updated_at < self.config.jwks_min_refresh_interval:
+                return
+        try:
+            await self._refresh_key_set()
+        except httpx.HTTPError as e:
+            logger.warning(f"Failed to refresh the key set of InNoHassle Accounts: {e!r}")
+
+    def get_public_key(self, kid: str = PUBLIC_KID) -> JsonWebKey | None:
         if self.key_set is None:
             raise RuntimeError("Key set should be initialized by `update_key_set`")
-        return self.key_set.find_by_kid(self.PUBLIC_KID)
-
-    async def get_key_set(self) -> KeySet:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{self.api_url}/.well-known/jwks.json")
-            response.raise_for_status()
-            jwks_json = response.json()
-            return JsonWebKey.import_key_set(jwks_json)
+        return self.keys.get(kid)
 
-    def decode_token(self, token: str) -> UserTokenData | None:
+    async def decode_token(self, token: str) -> UserTokenData | None:
         """
         Decode generated by InnoHassle Accounts user JWT token and return user data.
         If token is invalid, return None.
+        Results are cached, so the signature of the same token is verified only once.
         """
+        key = self.token_cache.key(token)
+        found, token_data = self.token_cache.get(key)
+        if found:
+            return token_data
         try:
-            payload = self._get_jwt_claims(token)
+            kid = self._get_kid(token)
+            pub_key = self.get_public_key(kid)
+            if pub_key is None:
+                # Keys may have been rotated
+                await self._refresh_key_set_on_miss()
+                pub_key = self.get_public_key(kid)
+            if pub_key is None:
+                # Not cached: the key may be loaded by the next refresh of the key set
+                return None
+            payload = self._get_jwt_claims(token, pub_key)
             innohassle_id: str = payload["uid"]
             email: str | None = payload.get("email")
             telegram_id: int | None = payload.get("telegram_id")
-            return UserTokenData(
+            token_data = UserTokenData(
                 innohassle_id=innohassle_id,
                 email=email,
                 telegram_id=telegram_id,
             )
         except JoseError:
             # logger.warning("Invalid token", exc_info=True)
+            self.token_cache.put(key, None)
             return None
+        expires_at = payload.get("exp")
+        if expires_at is not None:
+            self.token_cache.put(key, token_data, float(expires_at))
+        return token_data
 
     def get_authorized_client(self) -> httpx.AsyncClient:
         return httpx.AsyncClient(
             headers={"Authorization": f"Bearer {self.api_jwt_token}"},
             base_url=self.api_url,
+            http2=self.config.http2,
+            limits=httpx.Limits(
+                max_connections=self.config.max_connections,
+                max_keepalive_connections=self.config.max_keepalive_connections,
+                keepalive_expiry=self.config.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(self.config.timeout, connect=self.config.connect_timeout),
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared client with a pool of keep-alive connections, created on first use."""
+        if self._client is None or self._client.is_closed:
+            self._client = self.get_authorized_client()
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def get_pool_stats(self) -> ConnectionPoolStats:
+        # httpx does not expose its connection pool (httpcore.AsyncConnectionPool), so look into the transport.
+        # Private attributes may disappear after an update, so the stats degrade to zeros instead of failing.
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        try:
+            connections = list(pool.connections) if pool is not None else []
+            idle_connections = sum(connection.is_idle() for connection in connections)
+            http2_connections = sum(connection.info().startswith("HTTP/2") for connection in connections)
+        except (AttributeError, TypeError):
+            connections, idle_connections, http2_connections = [], 0, 0
+        try:
+            queued_requests = sum(request.connection is None for request in pool._requests)
+        except (AttributeError, TypeError):
+            queued_requests = None
+        return ConnectionPoolStats(
+            connections=len(connections),
+            idle_connections=idle_connections,
+            http2_connections=http2_connections,
+            queued_requests=queued_requests,
+        )
+
+    def get_breaker_stats(self) -> CircuitBreakerStats:
+        return CircuitBreakerStats(
+            state=self.breaker.state,
+            consecutive_failures=self.breaker.consecutive_failures,
+            failures=self.breaker.failures,
+            opened=self.breaker.opened,
+            rejected=self.breaker.rejected,
+            retries=self.retries,
+            retries_over_budget=self.retries_over_budget,
         )
 
-    def _get_jwt_claims(self, token: str) -> JWTClaims:
+    async def _request(self, method: str, url: str, timeout: float, **kwargs) -> httpx.Response:
+        """
+        Send a request through the circuit breaker, retrying connection errors, timeouts and 5xx responses
+        with jittered exponential backoff while the retry budget allows.
+        Error responses are returned as is, so callers should check the status.
+        """
+        self.retry_budget.deposit()
+        request_timeout = httpx.Timeout(timeout, connect=min(timeout, self.config.connect_timeout))
+        attempt = 0
+        while True:
+            self.breaker.before_request()
+            try:
+                response = await self.client.request(method, url, timeout=request_timeout, **kwargs)
+            except httpx.TransportError as e:
+                self.breaker.record_failure()
+                error: httpx.TransportError | httpx.Response = e
+            else:
+                if response.status_code < 500:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                error = response
+
+            if attempt >= self.config.max_retries:
+                break
+            if not self.retry_budget.try_withdraw():
+                self.retries_over_budget += 1
+                break
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(random.uniform(0, self.config.retry_backoff * 2**attempt))
+
+        if isinstance(error, httpx.Response):
+            return error
+        raise error
+
+    def _get_kid(self, token: str) -> str:
+        """Get the key id from the (not yet verified) token header."""
+        header_segment = token.split(".", 1)[0]
+        try:
+            header = json.loads(base64.urlsafe_b64decode(header_segment + "=" * (-len(header_segment) % 4)))
+        except ValueError:
+            raise JoseError("invalid_header", "Invalid token header")
+        if not isinstance(header, dict):
+            raise JoseError("invalid_header", "Invalid token header")
+        return header.get("kid") or self.PUBLIC_KID
+
+    def _get_jwt_claims(self, token: str, pub_key: JsonWebKey) -> JWTClaims:
         now = time.time()
-        pub_key = self.get_public_key()
         payload = jwt.decode(token, pub_key)
         payload.validate_exp(now, leeway=0)
         payload.validate_iat(now, leeway=0)
@@ -110,40 +468,157 @@ class InNoHassleAccounts:
         """
         Get user by one of the provided identifiers.
         If multiple identifiers are provided, the first one that exists will be returned.
+        Concurrent calls with the same identifiers share one upstream request.
         """
-        async with self.get_authorized_client() as client:
-            urls = []
-            if innohassle_id:
-                urls.append(f"/users/by-id/{innohassle_id}")
-            if email:
-                urls.append(f"/users/by-innomail/{email}")
-            if telegram_id:
-                urls.append(f"/users/by-telegram-id/{telegram_id}")
-            for url in urls:
-                response = await client.get(url)
-                try:
-                    response.raise_for_status()
-                    return UserSchema.model_validate(response.json())
-                except httpx.HTTPStatusError as e:
-                    if e.response.status_code == 404:
-                        continue
-                    raise e
+        if innohassle_id and not email and not telegram_id:
+            # Share in-flight requests with `get_users`
+            key = ("by-id", innohassle_id)
+        else:
+            key = ("get_user", innohassle_id, email, telegram_id)
+        return await asyncio.shield(self._single_flight(key, lambda: self._get_user(innohassle_id, email, telegram_id)))
+
+    async def _get_user(
+        self,
+        innohassle_id: str | None = None,
+        email: str | None = None,
+        telegram_id: int | None = None,
+    ) -> UserSchema | None:
+        urls = []
+        if innohassle_id:
+            urls.append(f"/users/by-id/{innohassle_id}")
+        if email:
+            urls.append(f"/users/by-innomail/{email}")
+        if telegram_id:
+            urls.append(f"/users/by-telegram-id/{telegram_id}")
+        if len(urls) > 1 and self.config.concurrent_lookups:
+            return await self._get_first_user(urls)
+        for url in urls:
+            user = await self._get_user_by_url(url)
+            if user is not None:
+                return user
+        return None
+
+    async def _get_first_user(self, urls: list[str]) -> UserSchema | None:
+        """
+        Request all urls concurrently and return the user from the first url (in the given order) that exists.
+        Remaining requests are cancelled as soon as the result is known.
+        """
+        tasks = [asyncio.create_task(self._get_user_by_url(url)) for url in urls]
+        try:
+            for task in tasks:
+                user = await task
+                if user is not None:
+                    return user
             return None
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _get_user_by_url(self, url: str) -> UserSchema | None:
+        response = await self._request("GET", url, timeout=self.config.lookup_timeout)
+        try:
+            response.raise_for_status()
+            return UserSchema.model_validate(response.json())
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                return None
+            raise e
 
     async def get_users(self, innohassle_ids: list[str]) -> dict[str, UserSchema | None]:
         """
         Get multiple users by ids.
+        Only ids that are not already being fetched by concurrent calls are requested upstream.
         """
-        async with self.get_authorized_client() as client:
-            response = await client.post(
-                f"{self.api_url}/users/by-id/get-bulk",
-                json=innohassle_ids,
-            )
-            response.raise_for_status()
-            return {k: UserSchema.model_validate(v) if v else None for k, v in response.json().items()}
+        innohassle_ids = list(dict.fromkeys(innohassle_ids))
+        not_in_flight = [id for id in innohassle_ids if ("by-id", id) not in self._in_flight]
+        if not_in_flight:
+            bulk = asyncio.create_task(self._get_users(not_in_flight))
+            for id in not_in_flight:
+                self._single_flight(("by-id", id), lambda id=id: self._pick_user(bulk, id))
+        tasks = [self._in_flight[("by-id", id)] for id in innohassle_ids]
+        users = await asyncio.shield(asyncio.gather(*tasks))
+        return dict(zip(innohassle_ids, users, strict=True))
+
+    async def load_user(self, innohassle_id: str) -> UserSchema | None:
+        """
+        Get user by id, batching concurrent lookups into bulk requests (DataLoader-style).
+        Lookups are collected for `batch_window` seconds or until `batch_max_size` ids are queued.
+        """
+        return await asyncio.shield(
+            self._single_flight(("by-id", innohassle_id), lambda: self._load_user(innohassle_id))
+        )
+
+    async def _load_user(self, innohassle_id: str) -> UserSchema | None:
+        future = asyncio.get_running_loop().create_future()
+        self._batch[innohassle_id] = future
+        if len(self._batch) >= self.config.batch_max_size:
+            self._dispatch_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = asyncio.get_running_loop().call_later(self.config.batch_window, self._dispatch_batch)
+        return await future
+
+    def _dispatch_batch(self) -> None:
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        batch, self._batch = self._batch, {}
+        if batch:
+            task = asyncio.create_task(self._resolve_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _resolve_batch(self, batch: dict[str, asyncio.Future[UserSchema | None]]) -> None:
+        try:
+            users = await self._get_users(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except asyncio.CancelledError:
+            for future in batch.values():
+                future.cancel()
+            raise
+        for innohassle_id, future in batch.items():
+            if not future.done():
+                future.set_result(users.get(innohassle_id))
+
+    async def _get_users(self, innohassle_ids: list[str]) -> dict[str, UserSchema | None]:
+        response = await self._request(
+            "POST",
+            "/users/by-id/get-bulk",
+            timeout=self.config.bulk_timeout,
+            json=innohassle_ids,
+        )
+        response.raise_for_status()
+        return {k: UserSchema.model_validate(v) if v else None for k, v in response.json().items()}
+
+    @staticmethod
+    async def _pick_user(bulk: asyncio.Task[dict[str, UserSchema | None]], innohassle_id: str) -> UserSchema | None:
+        return (await bulk).get(innohassle_id)
+
+    def _single_flight[T](self, key: tuple, coroutine_factory: Callable[[], Coroutine[Any, Any, T]]) -> asyncio.Task[T]:
+        """
+        Return the in-flight task for the key or start a new one.
+        The task is not bound to a caller, so cancellation of one caller does not affect the others.
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(coroutine_factory())
+            self._in_flight[key] = task
+
+            def on_done(done_task: asyncio.Task) -> None:
+                self._in_flight.pop(key, None)
+                if not done_task.cancelled():
+                    done_task.exception()  # Mark the exception as retrieved if nobody waits for the result
+
+            task.add_done_callback(on_done)
+        return task
 
 
 inh_accounts: InNoHassleAccounts = InNoHassleAccounts(
     api_url=settings.accounts.api_url,
     api_jwt_token=settings.accounts.api_jwt_token.get_secret_value(),
+    config=settings.accounts,
 )
@@ -1,5 +1,19 @@
+import asyncio
+import datetime
+import time
+from dataclasses import dataclass
+
+import httpx
+from pydantic import TypeAdapter
+
+import src.modules.clubs.crud as clubs_crud
+from src.api.conditional import make_etag
+from src.config import settings
+from src.config_schema import LeadersCache as LeadersCacheSettings
+from src.logging_ import logger
 from src.modules.inh_accounts_sdk import UserSchema, inh_accounts
 from src.pydantic_base import BaseSchema
+from src.storages.mongo.club import Club, LeaderSnapshot
 
 
 class Leader(BaseSchema):
@@ -24,13 +38,314 @@ def leader_from_user(user: UserSchema) -> Leader:
     )
 
 
-async def read_by_innohassle_id(innohassle_id: str) -> Leader | None:
-    leader_data = await inh_accounts.get_user(innohassle_id=innohassle_id)
-    if not leader_data:
+def leader_from_snapshot(snapshot: LeaderSnapshot) -> Leader:
+    return Leader(
+        innohassle_id=snapshot.innohassle_id,
+        name=snapshot.name,
+        email=snapshot.email,
+        telegram_alias=snapshot.telegram_alias,
+    )
+
+
+def snapshot_from_leader(leader: Leader, fetched_at: datetime.datetime | None = None) -> LeaderSnapshot:
+    fetched_at = fetched_at or datetime.datetime.now(datetime.UTC)
+    return LeaderSnapshot(
+        innohassle_id=leader.innohassle_id,
+        name=leader.name,
+        email=leader.email,
+        telegram_alias=leader.telegram_alias,
+        # MongoDB stores milliseconds, so cached copies would differ from the stored ones
+        fetched_at=fetched_at.replace(microsecond=fetched_at.microsecond // 1000 * 1000),
+    )
+
+
+def club_leader_snapshot(club: Club) -> Leader | None:
+    """Leader from the snapshot embedded in the club (None if there is no up-to-date snapshot)."""
+    if club.leader is None or club.leader.innohassle_id != club.leader_innohassle_id:
         return None
-    return leader_from_user(leader_data)
+    return leader_from_snapshot(club.leader)
+
+
+@dataclass(frozen=True, slots=True)
+class AllLeadersSnapshot:
+    """Serialized leaders of all clubs, ready to be sent as a response body."""
+
+    json: bytes
+    etag: str
+    versions: tuple[int, int]
+    "Versions of the clubs cache and of the leaders cache the snapshot was built from"
+    built_at: float
+
+
+class LeadersCacheStats(BaseSchema):
+    size: int
+    "Number of cached profiles (including not found users)"
+    hits: int
+    "Number of profiles served fresh from the cache"
+    stale_hits: int
+    "Number of profiles served stale from the cache"
+    misses: int
+    "Number of profiles fetched from InNoHassle Accounts while the request was waiting"
+    background_refreshes: int
+    "Number of background refreshes of stale profiles"
+    errors: int
+    "Number of failed requests to InNoHassle Accounts"
+
+
+@dataclass(slots=True)
+class _CacheEntry:
+    leader: Leader | None
+    "None if the user is not found"
+    fetched_at: float
+
+
+class LeadersCache:
+    """
+    Cache of leader profiles by InNoHassle ID with stale-while-revalidate semantics:
+    profiles older than `ttl` are served immediately and refreshed in the background,
+    and profiles older than `stale_ttl` are only used if InNoHassle Accounts is unavailable.
+    """
+
+    def __init__(self, config: LeadersCacheSettings):
+        self.config = config
+        self.entries: dict[str, _CacheEntry] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.background_refreshes = 0
+        self.errors = 0
+        self.version = 0
+        "Counter that is incremented when a cached profile is changed"
+        self.all_leaders_snapshot: AllLeadersSnapshot | None = None
+        "Response with leaders of all clubs, see `read_all_snapshot`"
+        self._refreshing: set[str] = set()
+        self._background_tasks: set[asyncio.Task] = set()
+
+    async def get_many(self, innohassle_ids: list[str]) -> dict[str, Leader | None]:
+        now = time.monotonic()
+        result: dict[str, Leader | None] = {}
+        to_fetch: list[str] = []
+        to_refresh: list[str] = []
+        for innohassle_id in dict.fromkeys(innohassle_ids):
+            if not innohassle_id:
+                continue
+            entry = self.entries.get(innohassle_id)
+            if entry is None:
+                to_fetch.append(innohassle_id)
+                continue
+            age = now - entry.fetched_at
+            ttl = self.config.ttl if entry.leader is not None else self.config.negative_ttl
+            if age < ttl:
+                self.hits += 1
+                result[innohassle_id] = entry.leader
+            elif entry.leader is not None and age < self.config.stale_ttl:
+                self.stale_hits += 1
+                result[innohassle_id] = entry.leader
+                to_refresh.append(innohassle_id)
+            else:
+                to_fetch.append(innohassle_id)
+
+        if to_refresh:
+            self._refresh_in_background(to_refresh)
+
+        if to_fetch:
+            self.misses += len(to_fetch)
+            fetched = await self.fetch(to_fetch)
+            result.update(fetched)
+            for innohassle_id in to_fetch:
+                if innohassle_id not in fetched:
+                    # Use stale data if InNoHassle Accounts is unavailable
+                    entry = self.entries.get(innohassle_id)
+                    result[innohassle_id] = entry.leader if entry else None
+        return result
+
+    def stats(self) -> LeadersCacheStats:
+        return LeadersCacheStats(
+            size=len(self.entries),
+            hits=self.hits,
+            stale_hits=self.stale_hits,
+            misses=self.misses,
+            background_refreshes=self.background_refreshes,
+            errors=self.errors,
+        )
+
+    async def fetch(self, innohassle_ids: list[str]) -> dict[str, Leader | None]:
+        """
+        Fetch profiles from InNoHassle Accounts and cache them.
+        Ids are requested in chunks with bounded concurrency; ids of failed chunks are missing from the result.
+        """
+        innohassle_ids = [id for id in dict.fromkeys(innohassle_ids) if id]
+        if len(innohassle_ids) == 1:
+            chunks = [innohassle_ids]
+        else:
+            size = self.config.bulk_chunk_size
+            chunks = [innohassle_ids[i : i + size] for i in range(0, len(innohassle_ids), size)]
+        semaphore = asyncio.Semaphore(self.config.bulk_concurrency)
+        results = await asyncio.gather(
+            *(self._fetch_chunk(chunk, semaphore) for chunk in chunks),
+            return_exceptions=True,
+        )
+        result = {}
+        for chunk, chunk_result in zip(chunks, results, strict=True):
+            if isinstance(chunk_result, httpx.HTTPError):
+                self.errors += 1
+                logger.warning(f"Failed to fetch {len(chunk)} leaders from InNoHassle Accounts: {chunk_result!r}")
+            elif isinstance(chunk_result, BaseException):
+                raise chunk_result
+            else:
+                result.update(chunk_result)
+        return result
+
+    async def _fetch_chunk(self, innohassle_ids: list[str], semaphore: asyncio.Semaphore) -> dict[str, Leader | None]:
+        async with semaphore:
+            if len(innohassle_ids) == 1:
+                user = await inh_accounts.load_user(innohassle_ids[0])
+                users = {innohassle_ids[0]: user}
+            else:
+                users = await inh_accounts.get_users(innohassle_ids=innohassle_ids)
+        fetched_at = time.monotonic()
+        result = {}
+        for innohassle_id in innohassle_ids:
+            user = users.get(innohassle_id)
+            leader = leader_from_user(user) if user else None
+            previous = self.entries.get(innohassle_id)
+            if previous is None or previous.leader != leader:
+                self.version += 1
+            self.entries[innohassle_id] = _CacheEntry(leader=leader, fetched_at=fetched_at)
+            result[innohassle_id] = leader
+        return result
+
+    def _refresh_in_background(self, innohassle_ids: list[str]) -> None:
+        innohassle_ids = [id for id in innohassle_ids if id not in self._refreshing]
+        if not innohassle_ids:
+            return
+        self._refreshing.update(innohassle_ids)
+        self.background_refreshes += 1
+        task = asyncio.create_task(self._refresh(innohassle_ids))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _refresh(self, innohassle_ids: list[str]) -> None:
+        try:
+            await self.fetch(innohassle_ids)
+        finally:
+            self._refreshing.difference_update(innohassle_ids)
+
+
+cache: LeadersCache = LeadersCache(settings.leaders_cache)
+
+
+async def read_by_innohassle_id(innohassle_id: str) -> Leader | None:
+    leaders = await cache.get_many([innohassle_id])
+    return leaders.get(innohassle_id)
 
 
 async def read_many_by_innohassle_ids(innohassle_ids: list[str]) -> dict[str, Leader | None]:
-    user_infos = await inh_accounts.get_users(innohassle_ids=innohassle_ids)
-    return {k: leader_from_user(user) if user else None for k, user in user_infos.items()}
+    return await cache.get_many(innohassle_ids)
+
+
+_all_leaders_adapter = TypeAdapter(dict[str, Leader | None])
+
+
+async def read_all_snapshot() -> AllLeadersSnapshot:
+    """
+    Leaders of all clubs, rebuilt only when clubs or cached leader profiles are changed
+    (and at least every `ttl` seconds, to let outdated profiles be refreshed).
+    """
+    await clubs_crud.cache.ensure_loaded()
+    snapshot = cache.all_leaders_snapshot
+    if (
+        snapshot is not None
+        and snapshot.versions == (clubs_crud.cache.version, cache.version)
+        and time.monotonic() - snapshot.built_at < cache.config.ttl
+    ):
+        return snapshot
+    leaders = await read_many_by_clubs(await clubs_crud.read_all())
+    body = _all_leaders_adapter.dump_json(leaders, by_alias=True)
+    # Versions are taken after reading, so changes made while reading lead to a rebuild on the next request
+    snapshot = cache.all_leaders_snapshot = AllLeadersSnapshot(
+        json=body,
+        etag=make_etag(body),
+        versions=(clubs_crud.cache.version, cache.version),
+        built_at=time.monotonic(),
+    )
+    return snapshot
+
+
+async def read_by_club(club: Club) -> Leader | None:
+    """Get the club leader from the embedded snapshot, or from InNoHassle Accounts if there is no snapshot."""
+    if not club.leader_innohassle_id:
+        return None
+    return club_leader_snapshot(club) or await read_by_innohassle_id(club.leader_innohassle_id)
+
+
+async def read_many_by_clubs(clubs: list[Club]) -> dict[str, Leader | None]:
+    """Get leaders of the clubs by their InNoHassle IDs, using the embedded snapshots where possible."""
+    result: dict[str, Leader | None] = {}
+    missing: list[str] = []
+    for club in clubs:
+        if not club.leader_innohassle_id:
+            continue
+        leader = club_leader_snapshot(club)
+        if leader is not None:
+            result[club.leader_innohassle_id] = leader
+        else:
+            missing.append(club.leader_innohassle_id)
+    if missing:
+        fetched = await read_many_by_innohassle_ids(missing)
+        for innohassle_id, leader in fetched.items():
+            result.setdefault(innohassle_id, leader)
+    return result
+
+
+async def with_leaders(clubs: list[Club]) -> list[Club]:
+    """
+    Copies of the clubs with up-to-date `leader` snapshots.
+    Leaders without an embedded snapshot are resolved at once with a single bulk lookup.
+    """
+    leaders = await read_many_by_clubs([club for club in clubs if club_leader_snapshot(club) is None])
+    fetched_at = datetime.datetime.now(datetime.UTC)
+    result = []
+    for club in clubs:
+        if not club.leader_innohassle_id:
+            result.append(club.model_copy(update={"leader": None}) if club.leader else club)
+        elif club_leader_snapshot(club) is None:
+            leader = leaders.get(club.leader_innohassle_id)
+            snapshot = snapshot_from_leader(leader, fetched_at) if leader else None
+            result.append(club.model_copy(update={"leader": snapshot}))
+        else:
+            result.append(club)
+    return result
+
+
+async def refresh_snapshots() -> int:
+    """
+    Fetch outdated leader snapshots of all clubs from InNoHassle Accounts in bulk and save them.
+    Snapshots of previous leaders are removed. Returns the number of updated clubs.
+    """
+    cleared = await clubs_crud.clear_outdated_leader_snapshots()
+    now = datetime.datetime.now(datetime.UTC)
+    max_age = datetime.timedelta(seconds=settings.leaders_cache.snapshot_ttl)
+    outdated = {
+        club.leader_innohassle_id
+        for club in await clubs_crud.read_all()
+        if club.leader_innohassle_id and (club_leader_snapshot(club) is None or now - club.leader.fetched_at >= max_age)
+    }
+    if not outdated:
+        return cleared
+    leaders = await cache.fetch(list(outdated))
+    fetched_at = datetime.datetime.now(datetime.UTC)
+    snapshots = [snapshot_from_leader(leader, fetched_at) for leader in leaders.values() if leader]
+    return cleared + await clubs_crud.set_leader_snapshots(snapshots)
+
+
+async def run_snapshots_refresher() -> None:
+    """Periodically refresh outdated leader snapshots, until cancelled."""
+    while True:
+        try:
+            updated = await refresh_snapshots()
+            if updated:
+                logger.info(f"Refreshed leader snapshots of {updated} clubs")
+        except Exception as e:
+            logger.warning(f"Failed to refresh leader snapshots: {e!r}")
+        await asyncio.sleep(settings.leaders_cache.snapshot_refresh_interval)
@@ -1,11 +1,13 @@
 from beanie import PydanticObjectId
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi_derive_responses import AutoDeriveResponsesAPIRoute
 from starlette import status
+from starlette.responses import Response
 
 import src.modules.clubs.crud as clubs_crud
 import src.modules.leaders.crud as c
 from src.api import docs
+from src.api.conditional import is_not_modified, not_modified_response, validator_headers
 
 router = APIRouter(
     prefix="/leaders",
@@ -22,12 +24,17 @@ docs.TAGS_INFO.append({"description": _description, "name": str(router.tags[0])}
     "/",
     responses={
         status.HTTP_200_OK: {"description": "Info about all club leaders"},
+        status.HTTP_304_NOT_MODIFIED: {"description": "Info about all club leaders is not modified"},
     },
+    response_model=dict[str, c.Leader | None],
 )
-async def get_all_leaders() -> dict[str, c.Leader | None]:
+async def get_all_leaders(request: Request) -> Response:
     """Get all club leaders."""
-    clubs = await clubs_crud.read_all()
-    return await c.read_many_by_innohassle_ids([club.leader_innohassle_id for club in clubs])
+    snapshot = await c.read_all_snapshot()
+    headers = validator_headers(snapshot.etag)
+    if is_not_modified(request.headers, snapshot.etag):
+        return not_modified_response(headers)
+    return Response(content=snapshot.json, media_type="application/json", headers=headers)
 
 
 @router.get(
@@ -43,7 +50,7 @@ async def get_club_leader_by_id(id: PydanticObjectId) -> c.Leader | None:
     if not club:
         raise HTTPException(status_code=404, detail="Club not found")
 
-    return await c.read_by_innohassle_id(club.leader_innohassle_id)
+    return await c.read_by_club(club)
 
 
 @router.get(
@@ -59,4 +66,4 @@ async def get_club_leader_by_slug(slug: str) -> c.Leader | None:
     if not club:
         raise HTTPException(status_code=404, detail="Club not found")
 
-    return await c.read_by_innohassle_id(club.leader_innohassle_id)
+    return await c.read_by_club(club)
@@ -0,0 +1,55 @@
+from fastapi import APIRouter
+from fastapi_derive_responses import AutoDeriveResponsesAPIRoute
+from starlette import status
+
+import src.modules.clubs.crud as clubs_crud
+import src.modules.leaders.crud as leaders_crud
+import src.modules.users.crud as users_crud
+from src.api import docs
+from src.api.dependencies import REQUIRE_ADMIN
+from src.modules.inh_accounts_sdk import CircuitBreakerStats, ConnectionPoolStats, TokenCacheStats, inh_accounts
+from src.pydantic_base import BaseSchema
+
+router = APIRouter(
+    prefix="/monitoring",
+    tags=["Monitoring"],
+    route_class=AutoDeriveResponsesAPIRoute,
+)
+_description = """
+Internal state of caches and integrations for monitoring.
+"""
+docs.TAGS_INFO.append({"description": _description, "name": str(router.tags[0])})
+
+
+class MonitoringStats(BaseSchema):
+    clubs_cache: clubs_crud.ClubsCacheStats
+    "In-process cache of clubs"
+    leaders_cache: leaders_crud.LeadersCacheStats
+    "Cache of club leaders profiles"
+    accounts_pool: ConnectionPoolStats
+    "Connection pool of the InNoHassle Accounts client"
+    accounts_breaker: CircuitBreakerStats
+    "Circuit breaker and retries of requests to InNoHassle Accounts"
+    token_cache: TokenCacheStats
+    "Cache of verified user tokens"
+    role_cache: users_crud.RoleCacheStats
+    "Cache of user roles"
+
+
+@router.get(
+    "/stats",
+    responses={
+        status.HTTP_200_OK: {"description": "Monitoring stats"},
+        status.HTTP_403_FORBIDDEN: {"description": "Only admin can view monitoring stats"},
+    },
+)
+async def get_stats(_: REQUIRE_ADMIN) -> MonitoringStats:
+    """Get stats of caches and integrations."""
+    return MonitoringStats(
+        clubs_cache=clubs_crud.cache.stats(),
+        leaders_cache=leaders_crud.cache.stats(),
+        accounts_pool=inh_accounts.get_pool_stats(),
+        accounts_breaker=inh_accounts.get_breaker_stats(),
+        token_cache=inh_accounts.token_cache.stats(),
+        role_cache=users_crud.role_cache.stats(),
+    )
@@ -1,15 +1,77 @@
+from collections import OrderedDict
+
+from src.config import settings
+from src.pydantic_base import BaseSchema
 from src.storages.mongo.user import User, UserRole
 
 
+class RoleCacheStats(BaseSchema):
+    size: int
+    "Number of cached roles"
+    hits: int
+    "Number of roles served from the cache"
+    misses: int
+    "Number of roles read from the database"
+    evictions: int
+    "Number of roles evicted from the cache because it is full"
+
+
+class RoleCache:
+    """LRU cache of user roles by InNoHassle ID, invalidated when a role is changed."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.roles: OrderedDict[str, UserRole] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._generation = 0
+
+    async def get(self, innohassle_id: str) -> UserRole:
+        role = self.roles.get(innohassle_id)
+        if role is not None:
+            self.hits += 1
+            self.roles.move_to_end(innohassle_id)
+            return role
+        self.misses += 1
+        generation = self._generation
+        user = await read_by_innohassle_id(innohassle_id)
+        role = user.role if user else UserRole.DEFAULT
+        # Do not cache the role if it was changed while we were reading it
+        if generation == self._generation:
+            self.roles[innohassle_id] = role
+            while len(self.roles) > self.max_size:
+                self.roles.popitem(last=False)
+                self.evictions += 1
+        return role
+
+    def invalidate(self, innohassle_id: str) -> None:
+        self._generation += 1
+        self.roles.pop(innohassle_id, None)
+
+    def stats(self) -> RoleCacheStats:
+        return RoleCacheStats(size=len(self.roles), hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+
+role_cache: RoleCache = RoleCache(settings.role_cache_size)
+
+
 async def read_by_innohassle_id(innohassle_id: str) -> User | None:
     return await User.find_one(User.innohassle_id == innohassle_id)
 
 
+async def read_role(innohassle_id: str) -> UserRole:
+    return await role_cache.get(innohassle_id)
+
+
 async def change_role_of_user(innohassle_id: str, role: UserRole):
     obj = await read_by_innohassle_id(innohassle_id)
-    if obj is None:
-        # Create a user if it does not exist
-        return await User(innohassle_id=innohassle_id, role=role).create()
-    obj.role = role
-    await obj.save()
-    return obj
+    try:
+        if obj is None:
+            # Create a user if it does not exist
+            return await User(innohassle_id=innohassle_id, role=role).create()
+        obj.role = role
+        await obj.save()
+        return obj
+    finally:
+        role_cache.invalidate(innohassle_id)
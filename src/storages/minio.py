@@ -1,3 +1,8 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import certifi
+import urllib3
 from minio import Minio
 
 from src.config import settings
@@ -8,4 +13,17 @@ minio_client: Minio = Minio(
     region=settings.minio.region,
     access_key=settings.minio.access_key,
     secret_key=settings.minio.secret_key.get_secret_value(),
+    # Same as the default client of minio, but with configured pool size and timeouts
+    http_client=urllib3.PoolManager(
+        maxsize=settings.minio.max_connections,
+        timeout=urllib3.Timeout(connect=settings.minio.connect_timeout, read=settings.minio.read_timeout),
+        cert_reqs="CERT_REQUIRED",
+        ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+        retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+    ),
+)
+
+minio_executor: ThreadPoolExecutor = ThreadPoolExecutor(
+    max_workers=settings.minio.max_connections, thread_name_prefix="minio"
 )
+"Threads for blocking requests of `minio_client`, one per pooled connection"
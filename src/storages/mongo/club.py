@@ -1,5 +1,6 @@
-__all__ = ["Club", "ClubSchema", "ClubType"]
+__all__ = ["Club", "ClubSchema", "ClubType", "LeaderSnapshot"]
 
+import datetime
 from enum import StrEnum
 
 from pydantic import Field
@@ -52,8 +53,37 @@ class ClubSchema(BaseSchema):
     "ID of sport type in InnoSport system (None if the club is not sport)"
 
 
+class LeaderSnapshot(BaseSchema):
+    """Copy of the club leader profile from InNoHassle Accounts"""
+
+    innohassle_id: str
+    "ID of the InNoHassle Accounts user (the snapshot is outdated if it differs from the club leader)"
+    name: str | None
+    "Full name (or None if unknown)"
+    email: str | None
+    "Innomail (or None if unknown)"
+    telegram_alias: str | None
+    "Telegram alias (or None if unknown)"
+    fetched_at: datetime.datetime
+    "Time when the profile was fetched from InNoHassle Accounts"
+
+
 class Club(ClubSchema, CustomDocument):
+    leader: LeaderSnapshot | None = None
+    "Snapshot of the club leader profile, refreshed in the background (None if not fetched yet)"
+
     class Settings:
         indexes = [
             IndexModel("slug", unique=True),
+            # For filtering and keyset pagination of the clubs list: every combination of equality filters
+            # (is_active, type, sport_id) has an index with these fields followed by _id
+            IndexModel([("is_active", 1), ("_id", 1)]),
+            IndexModel([("is_active", 1), ("type", 1), ("_id", 1)]),
+            IndexModel([("is_active", 1), ("sport_id", 1), ("_id", 1)]),
+            IndexModel([("is_active", 1), ("type", 1), ("sport_id", 1), ("_id", 1)]),
+            IndexModel([("type", 1), ("_id", 1)]),
+            IndexModel([("type", 1), ("sport_id", 1), ("_id", 1)]),
+            IndexModel([("sport_id", 1), ("_id", 1)]),
+            # For clubs of a leader and bulk updates of leader snapshots
+            IndexModel("leader_innohassle_id"),
         ]
@@ -0,0 +1,78 @@
+import pytest
+from beanie import PydanticObjectId
+
+from src.modules.clubs.search import SearchIndex, tokenize
+
+
+@pytest.mark.parametrize(
+    "forms",
+    [
+        ["программирование", "программирования", "программированию", "программированием", "программировании"],
+        ["секция", "секции", "секцию", "секцией", "секциях"],
+        ["сложность", "сложности", "сложностью", "сложностей"],
+        ["спортивный", "спортивного", "спортивную", "спортивным", "спортивными"],
+        ["dance", "dances", "dancing", "danced", "dancer"],
+        ["game", "games", "gaming"],
+        ["run", "runs", "running"],
+        ["activity", "activities"],
+        ["match", "matches"],
+    ],
+)
+def test_tokenize_word_forms(forms: list[str]):
+    stems = {term for form in forms for term in tokenize(form)}
+    assert len(stems) == 1, stems
+
+
+def test_tokenize():
+    assert tokenize("Шахматы, Ёлка & Board-games!") == tokenize("шахматы елка board games")
+    assert tokenize("") == []
+    assert len(tokenize("Клуб любителей chess 2025")) == 4
+
+
+@pytest.fixture
+def index() -> tuple[SearchIndex, dict[str, PydanticObjectId]]:
+    ids = {name: PydanticObjectId() for name in ("programming", "dance", "chess")}
+    index = SearchIndex()
+    index.add(
+        ids["programming"],
+        {"title": "Секция программирования", "description": "Олимпиадное программирование и gaming"},
+    )
+    index.add(ids["dance"], {"title": "Dancing club", "description": "Современные танцы"})
+    index.add(ids["chess"], {"title": "Шахматы", "short_description": "Шахматная секция"})
+    return index, ids
+
+
+@pytest.mark.parametrize(
+    ("query", "expected"),
+    [
+        ("секции", {"programming", "chess"}),
+        ("программировании", {"programming"}),
+        ("game", {"programming"}),
+        ("dance", {"dance"}),
+        ("танцам", {"dance"}),
+        ("прог", {"programming"}),
+        ("секция шахматы", {"chess"}),
+        ("секция dance", set()),
+        ("football", set()),
+        ("", set()),
+    ],
+)
+def test_search(index, query: str, expected: set[str]):
+    index, ids = index
+    assert set(index.search(query, limit=10)) == {ids[name] for name in expected}
+
+
+def test_search_order_and_limit(index):
+    index, ids = index
+    # The title match weighs more than the short description match
+    assert index.search("секция", limit=10) == [ids["programming"], ids["chess"]]
+    assert index.search("секция", limit=1) == [ids["programming"]]
+
+
+def test_search_remove(index):
+    index, ids = index
+    index.remove(ids["chess"])
+    assert len(index) == 2
+    assert index.search("шахматы", limit=10) == []
+    assert "шахмат" not in index.terms
+    assert index.search("секция", limit=10) == [ids["programming"]]